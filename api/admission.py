@@ -0,0 +1,531 @@
+"""
+Admission control for the API during sync storms.
+
+Every request under ADMISSION_PATHS is classified as heavy (sync and clear
+writes) or light (lookups, login, reports). Both classes pass token buckets
+keyed by JWT user id (signature checked), by client address (seen through
+ADMISSION_TRUSTED_PROXIES) and by the claimed X-Client-Id, so rotating the
+header or a token does not escape the address limit. Heavy requests then
+need one of ADMISSION_MAX_HEAVY slots, queueing FIFO for at most
+ADMISSION_HEAVY_TIMEOUT seconds. While light traffic is busy, heavy
+requests get half the slots, so logins and lookups keep their latency while
+branches bulk-load.
+
+Under WSGI a queued request holds a server thread, so the queue only uses
+threads not needed for the heavy slots and the light share. Under ASGI it
+waits on a future, and a request cancelled while queued gives back any slot
+it was handed.
+
+On PostgreSQL a heavy request also needs one of ADMISSION_MAX_HEAVY shared
+slots, session advisory locks taken with pg_try_advisory_lock, so the cap
+holds across every worker process and host, not just within one. A request
+that gets no shared slot within ADMISSION_HEAVY_TIMEOUT gives its local slot
+back and is rejected.
+
+Rejections are 429 with Retry-After. Rate limits, queues and counters are
+per worker process; counters are exposed by the admission stats view.
+"""
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.http import JsonResponse
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+
+HEAVY_PREFIXES = ('/api/sync/', '/api/clear/')
+HEAVY_METHODS = ('POST', 'PUT', 'DELETE')
+MAX_BUCKETS = 10000
+# How often a request holding a local slot retries for a shared one
+SLOT_POLL_SECONDS = 0.1
+# Admitted without a shared slot: not on PostgreSQL, or the lock connection failed
+NO_SLOT = -1
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self):
+        """Seconds until a token is available, 0 if one is available now"""
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdmissionGate:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        # threading.Event for WSGI waiters, asyncio futures for ASGI ones
+        self._waiters = deque()
+        self.heavy_active = 0
+        self.light_active = 0
+        self.heavy_seconds = None
+        self.counters = {
+            'admitted_light': 0,
+            'admitted_heavy': 0,
+            'rejected_rate_limit': 0,
+            'rejected_queue_full': 0,
+            'rejected_timeout': 0,
+            'rejected_shared_busy': 0,
+            'max_heavy_waiting': 0,
+        }
+
+    def _config(self, name, default):
+        return getattr(settings, name, default)
+
+    @property
+    def heavy_waiting(self):
+        return len(self._waiters)
+
+    def rate_limit(self, kind, keys):
+        """Seconds to wait before retrying, or 0 when every bucket had a token"""
+        rate, burst = self._config('ADMISSION_RATES', {}).get(kind, (10, 50))
+        share = self._config('ADMISSION_ADDRESS_SHARE', 4)
+        now = time.monotonic()
+        with self._lock:
+            if len(self._buckets) > MAX_BUCKETS:
+                # Forget keys that have been idle long enough to refill completely
+                self._buckets = {
+                    key: bucket for key, bucket in self._buckets.items()
+                    if now - bucket.updated < bucket.burst / bucket.rate
+                }
+            buckets = []
+            for key in keys:
+                bucket = self._buckets.get((kind, key))
+                if bucket is None:
+                    scale = share if key.startswith('addr:') else 1
+                    bucket = self._buckets[(kind, key)] = TokenBucket(rate * scale, burst * scale)
+                bucket.refill(now)
+                buckets.append(bucket)
+
+            # Only charge the buckets when every one of them has a token
+            wait = max(bucket.wait() for bucket in buckets)
+            if wait:
+                self.counters['rejected_rate_limit'] += 1
+                return wait
+            for bucket in buckets:
+                bucket.tokens -= 1
+            return 0
+
+    def _light_busy(self):
+        concurrency = self._config('ADMISSION_CONCURRENCY', 8)
+        return max(1, int(concurrency * self._config('ADMISSION_LIGHT_BUSY', 0.5)))
+
+    def _heavy_limit(self):
+        limit = self._config('ADMISSION_MAX_HEAVY', 4)
+        if self.light_active >= self._light_busy():
+            return max(1, limit // 2)
+        return limit
+
+    def _queue_limit(self, threaded):
+        limit = self._config('ADMISSION_HEAVY_QUEUE', 16)
+        if threaded:
+            spare = self._config('ADMISSION_CONCURRENCY', 8) - self._config('ADMISSION_MAX_HEAVY', 4) - self._light_busy()
+            limit = min(limit, max(spare, 0))
+        return limit
+
+    def retry_after(self):
+        """Rough time until a queued heavy request would be served"""
+        per_request = self.heavy_seconds or 1.0
+        queued = self.heavy_waiting + 1
+        return per_request * queued / max(self._heavy_limit(), 1)
+
+    def _request_heavy(self, waiter, threaded):
+        """
+        With the lock held: take a heavy slot (0), queue `waiter` (None) or
+        reject with a Retry-After in seconds
+        """
+        if not self._waiters and self.heavy_active < self._heavy_limit():
+            self.heavy_active += 1
+            self.counters['admitted_heavy'] += 1
+            return 0
+        if self.heavy_waiting >= self._queue_limit(threaded):
+            self.counters['rejected_queue_full'] += 1
+            return self.retry_after()
+        self._waiters.append(waiter)
+        self.counters['max_heavy_waiting'] = max(self.counters['max_heavy_waiting'], self.heavy_waiting)
+        return None
+
+    def _withdraw(self, waiter):
+        """
+        With the lock held: take `waiter` out of the queue. Returns False when
+        it had already been handed a slot, which the caller now owns.
+        """
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            return False
+        return True
+
+    def _wake(self):
+        """With the lock held: hand free slots to the oldest waiters"""
+        while self._waiters and self.heavy_active < self._heavy_limit():
+            waiter = self._waiters.popleft()
+            self.heavy_active += 1
+            self.counters['admitted_heavy'] += 1
+            if isinstance(waiter, threading.Event):
+                waiter.set()
+            else:
+                waiter.get_loop().call_soon_threadsafe(_resolve, waiter)
+
+    def acquire_heavy(self):
+        """
+        Take a heavy slot from a server thread, waiting in the queue; returns
+        0 on success or a Retry-After in seconds
+        """
+        event = threading.Event()
+        with self._lock:
+            retry_after = self._request_heavy(event, threaded=True)
+        if retry_after is not None:
+            return retry_after
+        if event.wait(self._config('ADMISSION_HEAVY_TIMEOUT', 30.0)):
+            return 0
+        with self._lock:
+            if self._withdraw(event):
+                self.counters['rejected_timeout'] += 1
+                return self.retry_after()
+        return 0
+
+    def _expire(self, future):
+        with self._lock:
+            if self._withdraw(future):
+                self.counters['rejected_timeout'] += 1
+                future.set_exception(asyncio.TimeoutError())
+
+    async def aacquire_heavy(self):
+        """Async counterpart of acquire_heavy that waits without a thread"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            retry_after = self._request_heavy(future, threaded=False)
+        if retry_after is not None:
+            return retry_after
+        timer = loop.call_later(self._config('ADMISSION_HEAVY_TIMEOUT', 30.0), self._expire, future)
+        try:
+            await future
+        except asyncio.TimeoutError:
+            with self._lock:
+                return self.retry_after()
+        except asyncio.CancelledError:
+            # The client went away; give back the slot if one was handed over
+            with self._lock:
+                if not self._withdraw(future):
+                    self.heavy_active -= 1
+                    self._wake()
+            raise
+        finally:
+            timer.cancel()
+        return 0
+
+    def release_heavy(self, elapsed=None):
+        with self._lock:
+            self.heavy_active -= 1
+            # No elapsed time when the request never ran
+            if elapsed is not None:
+                if self.heavy_seconds is None:
+                    self.heavy_seconds = elapsed
+                else:
+                    self.heavy_seconds += 0.2 * (elapsed - self.heavy_seconds)
+            self._wake()
+
+    def reject_heavy(self):
+        """Give back the slot of a request that got no shared slot; returns a Retry-After"""
+        with self._lock:
+            self.heavy_active -= 1
+            self.counters['rejected_shared_busy'] += 1
+            self._wake()
+            return self.retry_after()
+
+    def enter_light(self):
+        with self._lock:
+            self.light_active += 1
+            self.counters['admitted_light'] += 1
+
+    def exit_light(self):
+        with self._lock:
+            self.light_active -= 1
+            # Heavy slots may have opened up again now light traffic dropped
+            self._wake()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'heavy_active': self.heavy_active,
+                'heavy_waiting': self.heavy_waiting,
+                'heavy_limit': self._heavy_limit(),
+                'heavy_queue_limit': self._queue_limit(threaded=not getattr(settings, 'ASGI_SERVER', False)),
+                'light_active': self.light_active,
+                'light_busy': self._light_busy(),
+                'avg_heavy_seconds': round(self.heavy_seconds, 3) if self.heavy_seconds else None,
+                'buckets': len(self._buckets),
+                **self.counters,
+            }
+
+
+class SharedHeavySlots:
+    """
+    ADMISSION_MAX_HEAVY slots shared by all worker processes, as PostgreSQL
+    session advisory locks. They are held on a connection of their own, so
+    they outlive the request's connection and transactions, and are freed by
+    the server if the process dies.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connection = None
+        self.held = set()
+
+    def enabled(self):
+        return (getattr(settings, 'ADMISSION_SHARED_HEAVY', True)
+                and connections[DEFAULT_DB_ALIAS].vendor == 'postgresql')
+
+    def _reset(self):
+        """With the lock held: drop the lock connection, and the slots with it"""
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except DatabaseError:
+                pass
+        self._connection = None
+        self.held.clear()
+
+    def try_acquire(self):
+        """Lock a free slot and return its number, or None when all are taken"""
+        with self._lock:
+            try:
+                if self._connection is None:
+                    self._connection = connections.create_connection(DEFAULT_DB_ALIAS)
+                    # Used from whichever thread serves the request
+                    self._connection.inc_thread_sharing()
+                with self._connection.cursor() as cursor:
+                    for slot in range(getattr(settings, 'ADMISSION_MAX_HEAVY', 4)):
+                        if slot in self.held:
+                            continue
+                        cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", [f"admission_heavy:{slot}"])
+                        if cursor.fetchone()[0]:
+                            self.held.add(slot)
+                            return slot
+            except DatabaseError as e:
+                # The sync itself will fail if the database is really down
+                logger.warning(f"Shared heavy slots unavailable, using the per-process limit: {e}")
+                self._reset()
+                return NO_SLOT
+        return None
+
+    def release(self, slot):
+        with self._lock:
+            if slot not in self.held:
+                return
+            self.held.discard(slot)
+            try:
+                with self._connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", [f"admission_heavy:{slot}"])
+            except DatabaseError as e:
+                logger.warning(f"Could not release shared heavy slot {slot}: {e}")
+                self._reset()
+
+    def acquire(self, timeout):
+        """Wait up to `timeout` seconds for a slot; returns it, NO_SLOT or None"""
+        if not self.enabled():
+            return NO_SLOT
+        deadline = time.monotonic() + timeout
+        while True:
+            slot = self.try_acquire()
+            if slot is not None or time.monotonic() >= deadline:
+                return slot
+            time.sleep(SLOT_POLL_SECONDS)
+
+    async def aacquire(self, timeout):
+        """Async counterpart of acquire; the lock queries run on a thread"""
+        if not self.enabled():
+            return NO_SLOT
+        loop = asyncio.get_running_loop()
+
+        def release_late(attempt):
+            if not attempt.cancelled() and attempt.exception() is None:
+                loop.run_in_executor(None, self.release, attempt.result())
+
+        deadline = time.monotonic() + timeout
+        while True:
+            attempt = loop.run_in_executor(None, self.try_acquire)
+            try:
+                slot = await asyncio.shield(attempt)
+            except asyncio.CancelledError:
+                # The client went away; free the slot the attempt may still take
+                attempt.add_done_callback(release_late)
+                raise
+            if slot is not None or time.monotonic() >= deadline:
+                return slot
+            await asyncio.sleep(SLOT_POLL_SECONDS)
+
+    async def arelease(self, slot):
+        if slot in self.held:
+            # Shielded, so a cancelled request still frees its slot
+            await asyncio.shield(asyncio.get_running_loop().run_in_executor(None, self.release, slot))
+
+    def stats(self):
+        return {
+            'shared_heavy': self.enabled(),
+            'shared_heavy_held': len(self.held),
+        }
+
+
+gate = AdmissionGate()
+heavy_slots = SharedHeavySlots()
+
+
+def classify(request):
+    if request.method in HEAVY_METHODS and request.path.startswith(HEAVY_PREFIXES):
+        return 'heavy'
+    return 'light'
+
+
+def client_address(request):
+    """
+    The caller's address. Behind a trusted proxy it is the nearest
+    X-Forwarded-For hop that is not itself a trusted proxy; the rest of the
+    header is client supplied.
+    """
+    address = request.META.get('REMOTE_ADDR')
+    trusted = getattr(settings, 'ADMISSION_TRUSTED_PROXIES', [])
+    if address in trusted:
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        for hop in reversed([hop.strip() for hop in forwarded.split(',') if hop.strip()]):
+            address = hop
+            if hop not in trusted:
+                break
+    return address
+
+
+def client_keys(request):
+    """
+    Rate-limit keys: the JWT user id (signature checked), the client address
+    and the claimed client id. Login has no token, so it is always limited
+    by address as well as by whatever client id it claims.
+    """
+    keys = []
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    parts = header.split()
+    if len(parts) == 2 and parts[0] == 'Bearer':
+        try:
+            keys.append(f"user:{AccessToken(parts[1]).get('user_id')}")
+        except TokenError:
+            pass
+    keys.append(f"addr:{client_address(request)}")
+    client = request.META.get('HTTP_X_CLIENT_ID')
+    if client:
+        keys.append(f"client:{client[:100]}")
+    return keys
+
+
+def too_many_requests(reason, retry_after):
+    seconds = max(1, math.ceil(retry_after))
+    response = JsonResponse({"error": reason, "retry_after": seconds}, status=429)
+    response['Retry-After'] = str(seconds)
+    return response
+
+
+class AdmissionControlMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def _applies(self, request):
+        if not getattr(settings, 'ADMISSION_CONTROL_ENABLED', True):
+            return False
+        return request.path.startswith(getattr(settings, 'ADMISSION_PATHS', ('/api/', '/app1/login/')))
+
+    def _admit(self, request, kind):
+        wait = gate.rate_limit(kind, client_keys(request))
+        if wait:
+            return too_many_requests("Rate limit exceeded", wait)
+        return None
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self._applies(request):
+            return self.get_response(request)
+
+        kind = classify(request)
+        rejected = self._admit(request, kind)
+        if rejected:
+            return rejected
+
+        if kind == 'light':
+            gate.enter_light()
+            try:
+                return self.get_response(request)
+            finally:
+                gate.exit_light()
+
+        retry_after = gate.acquire_heavy()
+        if retry_after:
+            return too_many_requests("Server busy with other syncs", retry_after)
+        slot = heavy_slots.acquire(getattr(settings, 'ADMISSION_HEAVY_TIMEOUT', 30.0))
+        if slot is None:
+            return too_many_requests("Server busy with other syncs", gate.reject_heavy())
+        start = time.monotonic()
+        try:
+            return self.get_response(request)
+        finally:
+            heavy_slots.release(slot)
+            gate.release_heavy(time.monotonic() - start)
+
+    async def __acall__(self, request):
+        if not self._applies(request):
+            return await self.get_response(request)
+
+        kind = classify(request)
+        rejected = self._admit(request, kind)
+        if rejected:
+            return rejected
+
+        if kind == 'light':
+            gate.enter_light()
+            try:
+                return await self.get_response(request)
+            finally:
+                gate.exit_light()
+
+        retry_after = await gate.aacquire_heavy()
+        if retry_after:
+            return too_many_requests("Server busy with other syncs", retry_after)
+        try:
+            slot = await heavy_slots.aacquire(getattr(settings, 'ADMISSION_HEAVY_TIMEOUT', 30.0))
+        except asyncio.CancelledError:
+            gate.release_heavy()
+            raise
+        if slot is None:
+            return too_many_requests("Server busy with other syncs", gate.reject_heavy())
+        start = time.monotonic()
+        try:
+            return await self.get_response(request)
+        finally:
+            await heavy_slots.arelease(slot)
+            gate.release_heavy(time.monotonic() - start)
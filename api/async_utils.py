@@ -0,0 +1,105 @@
+"""
+Helpers for the async views served on the ASGI entry point.
+
+Lookups and login run as native coroutines so an idle POS device costs a
+socket, not a thread. Heavy sync writes keep their DRF views but are handed
+to a bounded thread pool when served over ASGI, so a burst of uploads
+cannot take every thread; under WSGI they stay plain sync views.
+"""
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import JsonResponse
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+logger = logging.getLogger(__name__)
+
+_jwt = JWTAuthentication()
+_write_executor = None
+
+
+async def authenticate(request):
+    """
+    Async equivalent of JWTAuthentication.authenticate: token validation is
+    pure CPU, the user lookup uses the async ORM. Returns (user, token) or None.
+    """
+    header = _jwt.get_header(request)
+    if header is None:
+        return None
+    raw_token = _jwt.get_raw_token(header)
+    if raw_token is None:
+        return None
+
+    token = _jwt.get_validated_token(raw_token)
+    try:
+        user_id = token[api_settings.USER_ID_CLAIM]
+    except KeyError:
+        raise InvalidToken("Token contained no recognizable user identification")
+
+    try:
+        user = await _jwt.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+    except (_jwt.user_model.DoesNotExist, ValueError):
+        raise AuthenticationFailed("User not found")
+    if not user.is_active:
+        raise AuthenticationFailed("User is inactive")
+    return user, token
+
+
+def jwt_required(view):
+    """Async counterpart of the IsAuthenticated + JWTAuthentication defaults"""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            result = await authenticate(request)
+        except (AuthenticationFailed, InvalidToken) as e:
+            # Same body DRF would render for the exception
+            detail = e.detail if isinstance(e.detail, dict) else {"detail": e.detail}
+            return JsonResponse(detail, status=401)
+        if result is None:
+            return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+        request.user, request.auth = result
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def _get_write_executor():
+    global _write_executor
+    if _write_executor is None:
+        _write_executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'SYNC_WRITE_WORKERS', 4),
+            thread_name_prefix='sync-write',
+        )
+    return _write_executor
+
+
+def _call_in_worker(view, request, *args, **kwargs):
+    close_old_connections()
+    try:
+        return view(request, *args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def on_write_executor(view):
+    """
+    Under ASGI, run a synchronous (DRF) write view on the bounded sync-write
+    pool. Under WSGI the view is returned unchanged: it already has a server
+    thread of its own, and wrapping it would force async_to_sync on every call.
+    """
+    if not getattr(settings, 'ASGI_SERVER', False):
+        return view
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _get_write_executor(),
+            functools.partial(_call_in_worker, view, request, *args, **kwargs),
+        )
+    return wrapper
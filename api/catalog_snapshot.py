@@ -0,0 +1,219 @@
+"""
+Immutable binary snapshot of the product catalog, shared by all workers on a
+host through mmap.
+
+Layout (little endian):
+    header   magic, version, generation, record count, index entry counts
+             and section offsets
+    code     sorted fixed-width entries: key (KEY_WIDTH bytes, NUL padded)
+    index    followed by the uint32 offset of the record in the heap
+    barcode  same layout as the code index
+    index
+    heap     length-prefixed JSON records
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+from .models import AccProduct, AccProductBatch
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'GGCS'
+VERSION = 1
+KEY_WIDTH = 64
+HEADER = struct.Struct('<4sHHQIIIQQQ')
+ENTRY = struct.Struct(f'<{KEY_WIDTH}sI')
+LENGTH = struct.Struct('<I')
+
+PRODUCT_FIELDS = ('code', 'name', 'product', 'brand', 'unit', 'taxcode', 'defect', 'company')
+BATCH_FIELDS = ('cost', 'salesprice', 'bmrp', 'barcode', 'secondprice', 'thirdprice')
+
+
+def snapshot_path():
+    return getattr(settings, 'CATALOG_SNAPSHOT_PATH', os.path.join(settings.BASE_DIR, 'catalog.snapshot'))
+
+
+def _key(value):
+    """Encode a lookup key, or None when it cannot be indexed"""
+    if value is None:
+        return None
+    encoded = str(value).strip().encode('utf-8')
+    # NUL is the index padding byte, so it cannot appear inside a key
+    if not encoded or len(encoded) > KEY_WIDTH or b'\0' in encoded:
+        return None
+    return encoded
+
+
+def _catalog_records():
+    """Join products with their batch row (one batch per product code)"""
+    batches = {
+        row['productcode']: row
+        for row in AccProductBatch.objects.values('productcode', *BATCH_FIELDS).iterator(chunk_size=2000)
+    }
+    for row in AccProduct.objects.values(*PRODUCT_FIELDS).iterator(chunk_size=2000):
+        batch = batches.pop(row['code'], None) or {}
+        row.update({field: batch.get(field) for field in BATCH_FIELDS})
+        yield row
+    # Batches without a product row are still reachable by code and barcode
+    for code, batch in batches.items():
+        row = dict.fromkeys(PRODUCT_FIELDS)
+        row['code'] = code
+        row.update({field: batch.get(field) for field in BATCH_FIELDS})
+        yield row
+
+
+def write_snapshot(path=None, records=None):
+    """
+    Build a new snapshot generation from `records` (default: the database)
+    and atomically replace the current file. Returns (generation, record count).
+    """
+    path = path or snapshot_path()
+    if records is None:
+        records = _catalog_records()
+    generation = time.time_ns()
+
+    heap = bytearray()
+    code_entries = []
+    barcode_entries = []
+    for record in records:
+        offset = len(heap)
+        payload = json.dumps(record, default=str, separators=(',', ':')).encode('utf-8')
+        heap += LENGTH.pack(len(payload)) + payload
+
+        code_key = _key(record['code'])
+        if code_key is not None:
+            code_entries.append((code_key, offset))
+        barcode_key = _key(record['barcode'])
+        if barcode_key is not None:
+            barcode_entries.append((barcode_key, offset))
+
+    code_entries.sort()
+    barcode_entries.sort()
+    record_count = len(code_entries)
+
+    code_offset = HEADER.size
+    barcode_offset = code_offset + len(code_entries) * ENTRY.size
+    heap_offset = barcode_offset + len(barcode_entries) * ENTRY.size
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # A unique temp file per writer: the post-sync thread and a request can
+    # both be building a generation in the same process
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        f = os.fdopen(fd, 'wb')
+    except Exception:
+        os.close(fd)
+        os.unlink(tmp_path)
+        raise
+    with f:
+        f.write(HEADER.pack(
+            MAGIC, VERSION, 0, generation, record_count,
+            len(code_entries), len(barcode_entries),
+            code_offset, barcode_offset, heap_offset,
+        ))
+        for key, offset in code_entries:
+            f.write(ENTRY.pack(key, offset))
+        for key, offset in barcode_entries:
+            f.write(ENTRY.pack(key, offset))
+        f.write(heap)
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        # mkstemp creates the file 0600; workers may run as other users
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+    logger.info(f"Wrote catalog snapshot generation {generation} with {record_count} records to {path}")
+    return generation, record_count
+
+
+class CatalogSnapshot:
+    """Read-only view over one mmapped snapshot generation"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.identity = (stat.st_ino, stat.st_mtime_ns)
+
+        (magic, version, _, self.generation, self.record_count,
+         self.code_count, self.barcode_count,
+         self.code_offset, self.barcode_offset, self.heap_offset) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.mm.close()
+            raise ValueError(f"Unsupported catalog snapshot format in {path}")
+
+    def _search(self, section_offset, count, value):
+        key = _key(value)
+        if key is None:
+            return None
+        key = key.ljust(KEY_WIDTH, b'\0')
+
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = section_offset + mid * ENTRY.size
+            if self.mm[start:start + KEY_WIDTH] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == count:
+            return None
+
+        found, offset = ENTRY.unpack_from(self.mm, section_offset + lo * ENTRY.size)
+        if found != key:
+            return None
+        start = self.heap_offset + offset
+        (length,) = LENGTH.unpack_from(self.mm, start)
+        start += LENGTH.size
+        return json.loads(self.mm[start:start + length])
+
+    def lookup_code(self, code):
+        return self._search(self.code_offset, self.code_count, code)
+
+    def lookup_barcode(self, barcode):
+        return self._search(self.barcode_offset, self.barcode_count, barcode)
+
+
+_current = None
+_lock = threading.Lock()
+
+
+def get_snapshot():
+    """
+    Return the newest snapshot generation for this process, remapping when the
+    file has been replaced. Returns None when no snapshot has been written yet.
+    """
+    global _current
+    path = snapshot_path()
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    snapshot = _current
+    if snapshot is not None and snapshot.identity == (stat.st_ino, stat.st_mtime_ns):
+        return snapshot
+
+    with _lock:
+        if _current is None or _current.identity != (stat.st_ino, stat.st_mtime_ns):
+            try:
+                # The previous mapping is left to the garbage collector so
+                # lookups still holding it can finish safely
+                _current = CatalogSnapshot(path)
+            except (OSError, ValueError, struct.error) as e:
+                logger.warning(f"Could not map catalog snapshot {path}: {e}")
+                return snapshot
+        return _current
@@ -0,0 +1,150 @@
+"""
+Per-table chunk and batch size tuning.
+
+Each successful insert reports its rows, payload bytes, insert time and the
+bulk_create batch size it used. From that the tuner keeps, per table:
+
+* an EWMA of insert cost (ms per row) for each candidate batch size, and
+  settles on the cheapest one, occasionally re-trying its neighbours so it
+  follows changes in load
+* an EWMA of payload bytes per row and end-to-end rows/sec, from which it
+  recommends a client chunk that stays under the byte budget and finishes
+  within SYNC_CHUNK_TARGET_SECONDS
+
+State is per process and seeded from recent SyncRun rows, so workers
+converge on the same numbers without coordinating.
+"""
+import logging
+import random
+import threading
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import SyncRun
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZES = (250, 500, 1000, 2000, 5000)
+DEFAULT_BATCH_SIZE = 1000
+MIN_SAMPLES = 3
+EXPLORE_RATE = 0.1
+ALPHA = 0.3
+# PostgreSQL caps a statement at 65535 bind parameters
+MAX_PARAMS = 65535
+
+MIN_CHUNK_ROWS = 100
+MAX_CHUNK_ROWS = 20000
+
+
+def _ewma(previous, value):
+    return value if previous is None else previous + ALPHA * (value - previous)
+
+
+class TableTuner:
+    def __init__(self, field_count):
+        limit = MAX_PARAMS // max(field_count, 1)
+        self.candidates = [size for size in BATCH_SIZES if size <= limit] or [limit]
+        self.cost = {}
+        self.samples = {}
+        self.bytes_per_row = None
+        self.rows_per_sec = None
+
+    def best_batch_size(self):
+        measured = [size for size in self.candidates if self.samples.get(size, 0) >= MIN_SAMPLES]
+        if not measured:
+            return DEFAULT_BATCH_SIZE if DEFAULT_BATCH_SIZE in self.candidates else self.candidates[-1]
+        return min(measured, key=lambda size: self.cost[size])
+
+    def batch_size(self, rows):
+        best = self.best_batch_size()
+        index = self.candidates.index(best)
+        # Batches larger than the insert cannot be measured, so never try them
+        neighbours = [size for size in self.candidates[max(index - 1, 0):index + 2] if size <= rows]
+        if not neighbours:
+            return best
+        untried = [size for size in neighbours if self.samples.get(size, 0) < MIN_SAMPLES]
+        if untried:
+            return untried[0]
+        if random.random() < EXPLORE_RATE:
+            return random.choice(neighbours)
+        return best
+
+    def observe(self, batch_size, rows, insert_ms, payload_bytes, duration_ms):
+        if rows <= 0:
+            return
+        # Chunks smaller than the batch say nothing about that batch size
+        if insert_ms and rows >= batch_size and batch_size in self.candidates:
+            self.cost[batch_size] = _ewma(self.cost.get(batch_size), insert_ms / rows)
+            self.samples[batch_size] = self.samples.get(batch_size, 0) + 1
+        if payload_bytes:
+            self.bytes_per_row = _ewma(self.bytes_per_row, payload_bytes / rows)
+        if duration_ms:
+            self.rows_per_sec = _ewma(self.rows_per_sec, rows / (duration_ms / 1000))
+
+    def recommendation(self):
+        target_bytes = getattr(settings, 'SYNC_CHUNK_TARGET_BYTES', 2_000_000)
+        target_seconds = getattr(settings, 'SYNC_CHUNK_TARGET_SECONDS', 2.0)
+        batch_size = self.best_batch_size()
+
+        limits = []
+        if self.bytes_per_row:
+            limits.append(target_bytes / self.bytes_per_row)
+        if self.rows_per_sec:
+            limits.append(self.rows_per_sec * target_seconds)
+        rows = int(min(limits)) if limits else DEFAULT_BATCH_SIZE
+        rows = max(MIN_CHUNK_ROWS, min(rows, MAX_CHUNK_ROWS))
+        if rows >= batch_size:
+            # Whole batches only, so no chunk ends in a short INSERT
+            rows -= rows % batch_size
+
+        return {
+            "rows": rows,
+            "bytes": int(rows * self.bytes_per_row) if self.bytes_per_row else target_bytes,
+            "batch_size": batch_size,
+            "bytes_per_row": round(self.bytes_per_row, 1) if self.bytes_per_row else None,
+            "rows_per_sec": round(self.rows_per_sec, 1) if self.rows_per_sec else None,
+        }
+
+
+_tuners = {}
+_lock = threading.Lock()
+
+
+def _seed(tuner, table):
+    runs = (SyncRun.objects
+            .filter(table=table, outcome='success', rows__gt=0)
+            .exclude(mode='clear')
+            .order_by('-started_at')[:20])
+    for run in reversed(list(runs)):
+        tuner.observe(
+            run.batch_size or DEFAULT_BATCH_SIZE, run.rows,
+            run.phases.get('insert'), run.bytes, run.load_ms,
+        )
+
+
+def get_tuner(model_class):
+    table = model_class._meta.db_table
+    tuner = _tuners.get(table)
+    if tuner is None:
+        with _lock:
+            tuner = _tuners.get(table)
+            if tuner is None:
+                tuner = TableTuner(len(model_class._meta.concrete_fields))
+                try:
+                    # Usually called inside a sync's transaction; the
+                    # savepoint keeps a failed seed from aborting it
+                    with transaction.atomic():
+                        _seed(tuner, table)
+                except Exception as e:
+                    logger.warning(f"Could not seed chunk tuning for {table}: {e}")
+                _tuners[table] = tuner
+    return tuner
+
+
+def batch_size_for(model_class, rows):
+    return get_tuner(model_class).batch_size(rows)
+
+
+def recommend(model_class):
+    return get_tuner(model_class).recommendation()
@@ -0,0 +1,109 @@
+import re
+
+from .models import AccMaster, CustomerIndex, CustomerPhone
+
+CUSTOMER_SUPER_CODE = 'DEBTO'
+# Digits in a complete national number; shorter digit groups are parts of one
+NATIONAL_DIGITS = 10
+PHONE_SEPARATORS = re.compile(r'[,;/|&\n]+')
+
+
+def _national(digits):
+    digits = digits.lstrip('0')
+    if len(digits) > NATIONAL_DIGITS and digits.startswith('91'):
+        digits = digits[2:]
+    return digits[:20]
+
+
+def normalize_phone(value):
+    """
+    Reduce one free-text phone number to its national digits:
+    '+91 98470-12345', '098470 12345' and '9847012345' all give '9847012345'
+    """
+    if not value:
+        return None
+    return _national(re.sub(r'\D', '', value)) or None
+
+
+def split_phones(value):
+    """
+    Normalize every number in a free-text phone field. Numbers may be split
+    by separators ('9847012345, 9847054321') or just by spaces, so digit
+    groups are joined until they make a complete number.
+    """
+    numbers = []
+    for part in PHONE_SEPARATORS.split(value or ''):
+        current = ''
+        for group in re.findall(r'\d+', part):
+            if current and len(_national(current)) >= NATIONAL_DIGITS:
+                numbers.append(_national(current))
+                current = ''
+            current += group
+        if _national(current):
+            numbers.append(_national(current))
+    return list(dict.fromkeys(numbers))
+
+
+def normalize_name(value):
+    return ' '.join((value or '').split()).lower()[:250]
+
+
+def _entries(masters):
+    customers = []
+    phones = []
+    for master in masters:
+        if master.super_code != CUSTOMER_SUPER_CODE:
+            continue
+        customers.append(CustomerIndex(code=master.code, name_key=normalize_name(master.name)))
+        numbers = split_phones(master.phone) + split_phones(master.phone2)
+        phones += [CustomerPhone(code=master.code, phone_key=number) for number in dict.fromkeys(numbers)]
+    return customers, phones
+
+
+def add_customers(masters):
+    """Index the DEBTO rows of a freshly inserted masters chunk"""
+    customers, phones = _entries(masters)
+    codes = [customer.code for customer in customers]
+    CustomerIndex.objects.filter(code__in=codes).delete()
+    CustomerPhone.objects.filter(code__in=codes).delete()
+    CustomerIndex.objects.bulk_create(customers, batch_size=1000)
+    CustomerPhone.objects.bulk_create(phones, batch_size=1000)
+
+
+def rebuild_customers(masters):
+    """Replace the whole index after the DEBTO masters were cleared"""
+    customers, phones = _entries(masters)
+    CustomerIndex.objects.all().delete()
+    CustomerPhone.objects.all().delete()
+    CustomerIndex.objects.bulk_create(customers, batch_size=1000)
+    CustomerPhone.objects.bulk_create(phones, batch_size=1000)
+
+
+def _customer_codes(phone, name, limit):
+    """Index query for the matching codes, or None when nothing usable was given"""
+    entries = CustomerIndex.objects.all()
+    phone_key = normalize_phone(phone)
+    name_key = normalize_name(name)
+
+    if phone_key:
+        entries = entries.filter(code__in=CustomerPhone.objects.filter(phone_key=phone_key).values('code'))
+    if name_key:
+        entries = entries.filter(name_key__startswith=name_key)
+    if not phone_key and not name_key:
+        return None
+
+    return entries.order_by('name_key').values_list('code', flat=True)[:limit]
+
+
+async def afind_customers(phone=None, name=None, limit=20):
+    """
+    Match customers on any number in either phone column and/or a name
+    prefix. Returns AccMaster rows, or an empty list when nothing usable was
+    given.
+    """
+    query = _customer_codes(phone, name, limit)
+    if query is None:
+        return []
+    codes = [code async for code in query]
+    masters = await AccMaster.objects.ain_bulk(codes)
+    return [masters[code] for code in codes if code in masters]
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.customer_index import CUSTOMER_SUPER_CODE, rebuild_customers
+from api.models import AccMaster, CustomerIndex, CustomerPhone
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the customer lookup index (customer_index, customer_phone) "
+        "from the DEBTO rows currently in acc_master. Run once after deploying "
+        "the lookup; masters syncs keep it current afterwards."
+    )
+
+    def handle(self, *args, **options):
+        masters = AccMaster.objects.filter(super_code=CUSTOMER_SUPER_CODE).iterator(chunk_size=2000)
+        with transaction.atomic():
+            rebuild_customers(masters)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {CustomerIndex.objects.count()} customers "
+            f"with {CustomerPhone.objects.count()} phone numbers"
+        ))
@@ -0,0 +1,234 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.partitions import CODE_GUARD, PARTITION_KEY, bound_name, is_partitioned, partition_name
+
+TABLE = 'acc_master'
+# Privileges on the guard table needed by each privilege on acc_master
+GUARD_PRIVILEGES = {
+    'SELECT': ('SELECT',),
+    'INSERT': ('INSERT',),
+    'UPDATE': ('SELECT', 'INSERT', 'DELETE'),
+    'DELETE': ('SELECT', 'DELETE'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert the unmanaged acc_master table into a table list-partitioned "
+        "by super_code, with one partition per given super_code and a default "
+        "partition for everything else. Enable ACC_MASTER_PARTITIONED afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--super-code', action='append', dest='super_codes', default=None,
+            help="super_code that gets its own partition (repeatable, default DEBTO)"
+        )
+        parser.add_argument('--dry-run', action='store_true', help="Print the SQL without running it")
+        parser.add_argument('--drop-old', action='store_true', help="Drop the original table after copying")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Partitioning requires PostgreSQL")
+        if is_partitioned(TABLE):
+            raise CommandError(f"{TABLE} is already partitioned")
+
+        super_codes = options['super_codes'] or ['DEBTO']
+        for value in super_codes:
+            if not value.isalnum():
+                raise CommandError(f"Invalid super_code: {value}")
+
+        with connection.cursor() as cursor:
+            self.check_dependents(cursor)
+            statements = self.build_statements(cursor, super_codes, options['drop_old'])
+
+        if options['dry_run']:
+            for sql in statements:
+                self.stdout.write(f"{sql};")
+            return
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            for sql in statements:
+                self.stdout.write(sql)
+                cursor.execute(sql)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{TABLE} partitioned by {PARTITION_KEY} ({', '.join(super_codes)} + default). "
+            f"Set ACC_MASTER_PARTITIONED=True to swap partitions on scoped syncs and clears."
+        ))
+
+    def check_dependents(self, cursor):
+        """
+        Refuse to convert while foreign keys, views, triggers, row-level
+        security or rows without a super_code depend on the current table:
+        they would stay bound to the renamed original, or cannot be placed in
+        the new one
+        """
+        cursor.execute(
+            "SELECT conname, conrelid::regclass::text FROM pg_constraint "
+            "WHERE contype = 'f' AND confrelid = %s::regclass",
+            [TABLE]
+        )
+        foreign_keys = [f"{name} on {table}" for name, table in cursor.fetchall()]
+        cursor.execute(
+            "SELECT DISTINCT r.ev_class::regclass::text FROM pg_depend d "
+            "JOIN pg_rewrite r ON r.oid = d.objid "
+            "WHERE d.classid = 'pg_rewrite'::regclass AND d.refobjid = %s::regclass "
+            "AND r.ev_class <> %s::regclass",
+            [TABLE, TABLE]
+        )
+        views = [name for (name,) in cursor.fetchall()]
+        cursor.execute(
+            "SELECT tgname FROM pg_trigger WHERE tgrelid = %s::regclass AND NOT tgisinternal",
+            [TABLE]
+        )
+        triggers = [name for (name,) in cursor.fetchall()]
+        cursor.execute(
+            "SELECT c.relrowsecurity OR EXISTS (SELECT 1 FROM pg_policy p WHERE p.polrelid = c.oid) "
+            "FROM pg_class c WHERE c.oid = %s::regclass",
+            [TABLE]
+        )
+        row_security = cursor.fetchone()[0]
+        if foreign_keys or views or triggers or row_security:
+            raise CommandError(
+                f"{TABLE} has dependent objects; drop or repoint them first. "
+                f"Foreign keys: {', '.join(foreign_keys) or 'none'}. Views: {', '.join(views) or 'none'}. "
+                f"Triggers: {', '.join(triggers) or 'none'}. "
+                f"Row-level security: {'enabled or has policies' if row_security else 'none'}."
+            )
+
+        q = connection.ops.quote_name
+        cursor.execute(f"SELECT count(*) FROM {q(TABLE)} WHERE {q(PARTITION_KEY)} IS NULL")
+        missing = cursor.fetchone()[0]
+        if missing:
+            raise CommandError(f"{missing} {TABLE} rows have no {PARTITION_KEY}; it becomes part of the primary key")
+
+    def build_statements(self, cursor, super_codes, drop_old):
+        q = connection.ops.quote_name
+        old = f"{TABLE}_unpartitioned"
+
+        cursor.execute(
+            "SELECT i.relname, x.indisprimary, x.indisunique, pg_get_indexdef(x.indexrelid), "
+            "array(SELECT a.attname FROM pg_attribute a "
+            "      WHERE a.attrelid = x.indrelid AND a.attnum = ANY(x.indkey)) "
+            "FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+            "WHERE x.indrelid = %s::regclass",
+            [TABLE]
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT grantee, privilege_type FROM information_schema.role_table_grants "
+            "WHERE table_name = %s AND grantee <> current_user",
+            [TABLE]
+        )
+        grants = cursor.fetchall()
+        cursor.execute(
+            "SELECT a.attname, pg_get_serial_sequence(%s, a.attname) FROM pg_attribute a "
+            "WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped",
+            [TABLE, TABLE]
+        )
+        sequences = [(column, sequence) for column, sequence in cursor.fetchall() if sequence]
+        cursor.execute(
+            "SELECT pg_get_userbyid(relowner) <> current_user, pg_get_userbyid(relowner) "
+            "FROM pg_class WHERE oid = %s::regclass",
+            [TABLE]
+        )
+        other_owner, owner = cursor.fetchone()
+
+        statements = [f"ALTER TABLE {q(TABLE)} RENAME TO {q(old)}"]
+        # The originals keep their index names free for the new table
+        for name, *_ in indexes:
+            statements.append(f"ALTER INDEX {q(name)} RENAME TO {q(f'{name[:49]}_unpartitioned')}")
+
+        # Defaults, CHECK and NOT NULL constraints, storage and comments;
+        # indexes are recreated below with the partition key added
+        statements.append(
+            f"CREATE TABLE {q(TABLE)} (LIKE {q(old)} INCLUDING ALL EXCLUDING INDEXES EXCLUDING IDENTITY) "
+            f"PARTITION BY LIST ({q(PARTITION_KEY)})"
+        )
+
+        primary_key = None
+        for name, primary, unique, definition, columns in indexes:
+            if primary:
+                primary_key = [column for column in columns if column != PARTITION_KEY] + [PARTITION_KEY]
+                statements.append(
+                    f"ALTER TABLE {q(TABLE)} ADD CONSTRAINT {q(name)} "
+                    f"PRIMARY KEY ({', '.join(q(column) for column in primary_key)})"
+                )
+            elif unique and PARTITION_KEY not in columns:
+                raise CommandError(
+                    f"Unique index {name} does not include {PARTITION_KEY} and cannot be "
+                    f"enforced on a partitioned table; drop it or add {PARTITION_KEY} first"
+                )
+            else:
+                definition = re.sub(r' ON (ONLY )?\S+ USING ', f' ON {q(TABLE)} USING ', definition, count=1)
+                statements.append(definition)
+        if primary_key is None:
+            statements.append(f"ALTER TABLE {q(TABLE)} ADD PRIMARY KEY (code, {q(PARTITION_KEY)})")
+
+        for grantee, privilege in grants:
+            role = 'PUBLIC' if grantee == 'PUBLIC' else q(grantee)
+            statements.append(f"GRANT {privilege} ON {q(TABLE)} TO {role}")
+        for column, sequence in sequences:
+            # Otherwise dropping the original would drop the sequence too
+            statements.append(f"ALTER SEQUENCE {sequence} OWNED BY {q(TABLE)}.{q(column)}")
+
+        values = ', '.join(f"'{value}'" for value in super_codes)
+        for value in super_codes:
+            name = partition_name(TABLE, value)
+            statements += [
+                f"CREATE TABLE {q(name)} PARTITION OF {q(TABLE)} FOR VALUES IN ('{value}')",
+                f"ALTER TABLE {q(name)} ADD CONSTRAINT {q(bound_name(name))} "
+                f"CHECK ({q(PARTITION_KEY)} IS NOT NULL AND {q(PARTITION_KEY)} = '{value}')",
+            ]
+        default = f"{TABLE}_default"
+        statements += [
+            f"CREATE TABLE {q(default)} PARTITION OF {q(TABLE)} DEFAULT",
+            # Lets ATTACH of a swapped-in partition skip scanning the default
+            f"ALTER TABLE {q(default)} ADD CONSTRAINT {q(bound_name(default))} "
+            f"CHECK ({q(PARTITION_KEY)} NOT IN ({values}))",
+            f"INSERT INTO {q(TABLE)} SELECT * FROM {q(old)}",
+        ]
+
+        # The primary key only makes code unique within a ledger; the guard
+        # table keeps it unique across all of them
+        statements += [
+            f"CREATE TABLE {q(CODE_GUARD)} AS SELECT code, {q(PARTITION_KEY)} FROM {q(old)}",
+            f"ALTER TABLE {q(CODE_GUARD)} ADD PRIMARY KEY (code)",
+            f"CREATE INDEX {q(f'{CODE_GUARD}_{PARTITION_KEY}')} ON {q(CODE_GUARD)} ({q(PARTITION_KEY)})",
+            f"""CREATE FUNCTION {q(f'{CODE_GUARD}_sync')}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM {q(CODE_GUARD)} WHERE code = OLD.code;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO {q(CODE_GUARD)} (code, {q(PARTITION_KEY)}) VALUES (NEW.code, NEW.{q(PARTITION_KEY)});
+    END IF;
+    RETURN NULL;
+END
+$$""",
+            f"CREATE TRIGGER {q(f'{CODE_GUARD}_sync')} AFTER INSERT OR DELETE OR UPDATE OF code, {q(PARTITION_KEY)} "
+            f"ON {q(TABLE)} FOR EACH ROW EXECUTE FUNCTION {q(f'{CODE_GUARD}_sync')}()",
+        ]
+        # The trigger writes the guard with the privileges of whoever writes
+        # acc_master: an UPDATE deletes and inserts guard rows, and a DELETE
+        # by code needs SELECT
+        guard_grants = {}
+        for grantee, privilege in grants:
+            guard_grants.setdefault(grantee, set()).update(GUARD_PRIVILEGES.get(privilege, ()))
+        for grantee, privileges in guard_grants.items():
+            if privileges:
+                role = 'PUBLIC' if grantee == 'PUBLIC' else q(grantee)
+                statements.append(f"GRANT {', '.join(sorted(privileges))} ON {q(CODE_GUARD)} TO {role}")
+        if other_owner:
+            # Everything above is owned by whoever ran the command
+            owned = [TABLE] + [partition_name(TABLE, value) for value in super_codes] + [default, CODE_GUARD]
+            statements += [f"ALTER TABLE {q(name)} OWNER TO {q(owner)}" for name in owned]
+            statements.append(f"ALTER FUNCTION {q(f'{CODE_GUARD}_sync')}() OWNER TO {q(owner)}")
+        statements.append(f"ANALYZE {q(TABLE)}")
+        if drop_old:
+            statements.append(f"DROP TABLE {q(old)}")
+        return statements
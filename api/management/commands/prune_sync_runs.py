@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from api.sync_history import prune_sync_runs
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete sync run history older than SYNC_RUN_RETENTION_DAYS (or --days). "
+        "Workers also prune on their own once an hour while syncs arrive."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help="Keep this many days instead")
+
+    def handle(self, *args, **options):
+        deleted = prune_sync_runs(options['days'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} sync runs"))
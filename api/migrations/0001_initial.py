@@ -0,0 +1,94 @@
+# Generated by Django 5.2.1 on 2026-10-18 22:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccMaster',
+            fields=[
+                ('code', models.CharField(max_length=30, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=250)),
+                ('super_code', models.CharField(blank=True, max_length=5, null=True)),
+                ('address', models.CharField(blank=True, max_length=100, null=True)),
+                ('phone', models.CharField(blank=True, max_length=60, null=True)),
+                ('phone2', models.CharField(blank=True, max_length=60, null=True)),
+            ],
+            options={
+                'db_table': 'acc_master',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='AccProduct',
+            fields=[
+                ('code', models.CharField(max_length=30, primary_key=True, serialize=False)),
+                ('name', models.CharField(blank=True, max_length=200, null=True)),
+                ('product', models.CharField(blank=True, max_length=30, null=True)),
+                ('brand', models.CharField(blank=True, max_length=30, null=True)),
+                ('unit', models.CharField(blank=True, max_length=10, null=True)),
+                ('taxcode', models.CharField(blank=True, max_length=5, null=True)),
+                ('defect', models.CharField(blank=True, max_length=50, null=True)),
+                ('company', models.CharField(blank=True, max_length=30, null=True)),
+            ],
+            options={
+                'db_table': 'acc_product',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='AccProductBatch',
+            fields=[
+                ('productcode', models.CharField(max_length=30, primary_key=True, serialize=False)),
+                ('cost', models.DecimalField(blank=True, decimal_places=3, max_digits=12, null=True)),
+                ('salesprice', models.DecimalField(blank=True, decimal_places=3, max_digits=10, null=True)),
+                ('bmrp', models.DecimalField(blank=True, decimal_places=3, max_digits=12, null=True)),
+                ('barcode', models.CharField(blank=True, max_length=35, null=True)),
+                ('secondprice', models.DecimalField(blank=True, decimal_places=3, max_digits=10, null=True)),
+                ('thirdprice', models.DecimalField(blank=True, decimal_places=3, max_digits=10, null=True)),
+            ],
+            options={
+                'db_table': 'acc_productbatch',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='AccUsers',
+            fields=[
+                ('id', models.CharField(max_length=30, primary_key=True, serialize=False)),
+                ('pass_field', models.CharField(db_column='pass', max_length=100)),
+                ('role', models.CharField(blank=True, max_length=30, null=True)),
+            ],
+            options={
+                'db_table': 'acc_users',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='SyncRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(max_length=50)),
+                ('mode', models.CharField(max_length=30)),
+                ('rows', models.IntegerField(default=0)),
+                ('bytes', models.BigIntegerField(default=0)),
+                ('phases', models.JSONField(default=dict)),
+                ('duration_ms', models.FloatField(default=0)),
+                ('outcome', models.CharField(max_length=10)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('client', models.CharField(blank=True, max_length=100, null=True)),
+                ('started_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'sync_run',
+                'indexes': [models.Index(fields=['table', '-started_at'], name='sync_run_table_7a836f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.1 on 2026-10-18 22:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerIndex',
+            fields=[
+                ('code', models.CharField(max_length=30, primary_key=True, serialize=False)),
+                ('name_key', models.CharField(max_length=250)),
+            ],
+            options={
+                'db_table': 'customer_index',
+                'indexes': [models.Index(fields=['name_key'], name='customer_name_prefix_idx', opclasses=['varchar_pattern_ops'])],
+            },
+        ),
+        migrations.CreateModel(
+            name='CustomerPhone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.CharField(db_index=True, max_length=30)),
+                ('phone_key', models.CharField(db_index=True, max_length=20)),
+            ],
+            options={
+                'db_table': 'customer_phone',
+                'unique_together': {('code', 'phone_key')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 22:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_customer_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncrun',
+            name='maintenance',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='syncrun',
+            name='snapshot_generation',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 22:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_sync_run_maintenance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncrun',
+            name='batch_size',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
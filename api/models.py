@@ -57,3 +57,58 @@ class AccUsers(models.Model):
     class Meta:
         db_table = 'acc_users'
         managed = False
+
+
+class SyncRun(models.Model):
+    """One sync or clear operation, kept for throughput trend analysis"""
+    table = models.CharField(max_length=50)
+    mode = models.CharField(max_length=30)
+    rows = models.IntegerField(default=0)
+    bytes = models.BigIntegerField(default=0)
+    batch_size = models.IntegerField(blank=True, null=True)
+    phases = models.JSONField(default=dict)
+    duration_ms = models.FloatField(default=0)
+    outcome = models.CharField(max_length=10)
+    error = models.TextField(blank=True, null=True)
+    client = models.CharField(max_length=100, blank=True, null=True)
+    started_at = models.DateTimeField()
+    maintenance = models.JSONField(blank=True, null=True)
+    # Catalog snapshot generation the sync wrote before responding, if any
+    snapshot_generation = models.BigIntegerField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'sync_run'
+        indexes = [
+            models.Index(fields=['table', '-started_at']),
+        ]
+
+    @property
+    def load_ms(self):
+        """Duration without the catalog snapshot rebuild, which costs the same whatever the row count"""
+        return self.duration_ms - (self.phases or {}).get('snapshot', 0)
+
+
+class CustomerIndex(models.Model):
+    """
+    Normalized name key for DEBTO masters, maintained by the masters sync so
+    counter lookups never scan acc_master
+    """
+    code = models.CharField(max_length=30, primary_key=True)
+    name_key = models.CharField(max_length=250)
+
+    class Meta:
+        db_table = 'customer_index'
+        indexes = [
+            # varchar_pattern_ops lets PostgreSQL serve LIKE 'prefix%' from the index
+            models.Index(fields=['name_key'], name='customer_name_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ]
+
+
+class CustomerPhone(models.Model):
+    """One normalized number from a DEBTO master's phone or phone2 field"""
+    code = models.CharField(max_length=30, db_index=True)
+    phone_key = models.CharField(max_length=20, db_index=True)
+
+    class Meta:
+        db_table = 'customer_phone'
+        unique_together = [('code', 'phone_key')]
@@ -0,0 +1,210 @@
+"""
+Support for running acc_master list-partitioned by super_code.
+
+When ACC_MASTER_PARTITIONED is on (after `manage.py partition_acc_master`),
+scoped syncs load the new rows into a staging table outside any lock on
+acc_master and swap it in for the super_code partition with a short
+DETACH/ATTACH transaction, and scoped clears truncate the partition, so a
+DEBTO refresh never scans or locks the other ledgers.
+
+The partitioned table's primary key is (code, super_code); CODE_GUARD keeps
+code unique across partitions and is maintained by a trigger, or directly
+here where rows move without one firing.
+"""
+import logging
+import uuid
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .chunk_tuning import batch_size_for
+from .sync_history import phase
+
+logger = logging.getLogger(__name__)
+
+PARTITION_KEY = 'super_code'
+CODE_GUARD = 'acc_master_codes'
+
+
+def partition_name(table, value):
+    return f"{table}_{value.lower()}"
+
+
+def bound_name(name):
+    """CHECK constraint matching a partition's bound, so ATTACH can skip its scan"""
+    return f"{name}_bound"
+
+
+def is_partitioned(table):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+            "WHERE c.relname = %s",
+            [table]
+        )
+        return cursor.fetchone() is not None
+
+
+def _partition_for(model_class, filter_kwargs):
+    """The partition a scoped clear maps onto, or None to fall back to DELETE"""
+    if not getattr(settings, 'ACC_MASTER_PARTITIONED', False):
+        return None
+    if connection.vendor != 'postgresql':
+        return None
+    table = model_class._meta.db_table
+    if table != 'acc_master' or not filter_kwargs or set(filter_kwargs) != {PARTITION_KEY}:
+        return None
+
+    name = partition_name(table, filter_kwargs[PARTITION_KEY])
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass AND c.relname = %s",
+            [table, name]
+        )
+        if cursor.fetchone() is None:
+            logger.warning(f"Partition {name} not found, falling back to DELETE")
+            return None
+    return name
+
+
+def _has_guard(cursor):
+    cursor.execute("SELECT to_regclass(%s)", [CODE_GUARD])
+    return cursor.fetchone()[0] is not None
+
+
+def truncate_scoped(model_class, filter_kwargs):
+    """
+    TRUNCATE the partition holding `filter_kwargs` rows and return how many
+    rows it had, or None when the clear has to be a filtered DELETE
+    """
+    name = _partition_for(model_class, filter_kwargs)
+    if name is None:
+        return None
+
+    q = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) FROM {q(name)}")
+        count = cursor.fetchone()[0]
+        cursor.execute(f"TRUNCATE {q(name)}")
+        # TRUNCATE fires no row triggers
+        if _has_guard(cursor):
+            cursor.execute(
+                f"DELETE FROM {q(CODE_GUARD)} WHERE {q(PARTITION_KEY)} = %s",
+                [filter_kwargs[PARTITION_KEY]]
+            )
+    logger.info(f"Truncated partition {name} ({count} rows)")
+    return count
+
+
+def _insert_rows(cursor, table, model_class, instances, batch_size):
+    q = connection.ops.quote_name
+    fields = model_class._meta.concrete_fields
+    columns = ', '.join(q(field.column) for field in fields)
+    row = f"({', '.join(['%s'] * len(fields))})"
+    for start in range(0, len(instances), batch_size):
+        batch = instances[start:start + batch_size]
+        params = [
+            field.get_db_prep_save(field.pre_save(instance, True), connection)
+            for instance in batch
+            for field in fields
+        ]
+        cursor.execute(f"INSERT INTO {q(table)} ({columns}) VALUES {', '.join([row] * len(batch))}", params)
+
+
+def _index_names(cursor, name):
+    """Index names of partition `name`, keyed by the parent index they belong to"""
+    cursor.execute(
+        "SELECT i.inhparent, c.relname FROM pg_index x "
+        "JOIN pg_class c ON c.oid = x.indexrelid JOIN pg_inherits i ON i.inhrelid = x.indexrelid "
+        "WHERE x.indrelid = %s::regclass",
+        [name]
+    )
+    return dict(cursor.fetchall())
+
+
+def replace_partition(model_class, filter_kwargs, instances, run=None, after_write=None):
+    """
+    Replace the rows of the partition holding `filter_kwargs` with
+    `instances` and return how many were inserted, or None when the sync
+    has to clear and insert in one transaction instead.
+
+    Rows are loaded into a staging table first; only the swap, and
+    `after_write`, run in a transaction, so acc_master is locked for the
+    DETACH/ATTACH alone and readers keep seeing the old rows until then.
+    """
+    name = _partition_for(model_class, filter_kwargs)
+    if name is None:
+        return None
+
+    table = model_class._meta.db_table
+    value = filter_kwargs[PARTITION_KEY]
+    suffix = uuid.uuid4().hex[:8]
+    stage = f"{name}_stage_{suffix}"
+    old = f"{name}_old_{suffix}"
+    q = connection.ops.quote_name
+
+    try:
+        with connection.cursor() as cursor:
+            with phase(run, "stage"):
+                # Copies the partition's columns, indexes and constraints,
+                # including its bound CHECK when the command created it
+                cursor.execute(f"CREATE TABLE {q(stage)} (LIKE {q(name)} INCLUDING ALL)")
+                cursor.execute(
+                    "SELECT 1 FROM pg_constraint WHERE conrelid = %s::regclass AND conname = %s",
+                    [stage, bound_name(name)]
+                )
+                if cursor.fetchone() is None:
+                    cursor.execute(
+                        f"ALTER TABLE {q(stage)} ADD CONSTRAINT {q(bound_name(name))} "
+                        f"CHECK ({q(PARTITION_KEY)} IS NOT NULL AND {q(PARTITION_KEY)} = %s)",
+                        [value]
+                    )
+
+            if instances:
+                batch_size = batch_size_for(model_class, len(instances))
+                if run:
+                    run.batch_size = batch_size
+                with phase(run, "insert"):
+                    _insert_rows(cursor, stage, model_class, instances, batch_size)
+
+            with transaction.atomic():
+                if after_write:
+                    with phase(run, "index"):
+                        after_write(instances)
+
+                with phase(run, "swap"):
+                    if _has_guard(cursor):
+                        # A code already used by another ledger fails here,
+                        # before acc_master is touched
+                        cursor.execute(f"DELETE FROM {q(CODE_GUARD)} WHERE {q(PARTITION_KEY)} = %s", [value])
+                        cursor.execute(
+                            f"INSERT INTO {q(CODE_GUARD)} (code, {q(PARTITION_KEY)}) "
+                            f"SELECT code, {q(PARTITION_KEY)} FROM {q(stage)}"
+                        )
+                    index_names = _index_names(cursor, name)
+                    cursor.execute(f"ALTER TABLE {q(table)} DETACH PARTITION {q(name)}")
+                    cursor.execute(f"ALTER TABLE {q(name)} RENAME TO {q(old)}")
+                    cursor.execute(f"ALTER TABLE {q(stage)} RENAME TO {q(name)}")
+                    cursor.execute(f"ALTER TABLE {q(table)} ATTACH PARTITION {q(name)} FOR VALUES IN (%s)", [value])
+                    # Give the staged indexes the names the partition had, so
+                    # they don't carry a new suffix after every swap
+                    for number, (parent, index) in enumerate(_index_names(cursor, name).items()):
+                        original = index_names.get(parent)
+                        if original and original != index:
+                            cursor.execute(f"ALTER INDEX {q(original)} RENAME TO {q(f'{old}_{number}')}")
+                            cursor.execute(f"ALTER INDEX {q(index)} RENAME TO {q(original)}")
+    except Exception:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {q(stage)}")
+        raise
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE {q(old)}")
+    except Exception as e:
+        # The swap is committed; the detached table only wastes space
+        logger.warning(f"Could not drop detached partition {old}: {e}")
+
+    logger.info(f"Swapped {len(instances)} rows into partition {name}")
+    return len(instances)
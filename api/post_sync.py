@@ -0,0 +1,367 @@
+"""
+Post-sync maintenance pipeline.
+
+After a sync or clear commits, the table is scheduled for maintenance on a
+background thread so the response is not held up. Requests for the same
+table are debounced (POST_SYNC_DELAY), so a stream of chunk uploads
+triggers one pipeline run once the stream goes quiet.
+
+Chunks of one stream land on different worker processes, so "quiet" is
+judged from the SyncRun rows of every worker. Database steps run on one
+worker, chosen by a per-table advisory lock, which stores the step timings
+on every SyncRun row not yet maintained. The catalog snapshot is a file on
+each host, so every host keeps its own copy current: one process per host
+(a file lock) rebuilds it when a products or batches change is newer than
+it, also on hosts that only serve lookups.
+"""
+import fcntl
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, close_old_connections
+from django.utils import timezone
+
+from .catalog_snapshot import snapshot_path, write_snapshot, get_snapshot
+from .models import SyncRun
+
+logger = logging.getLogger(__name__)
+
+# Tables maintained alongside a synced table
+DERIVED_TABLES = {
+    'acc_master': ['customer_index', 'customer_phone'],
+}
+
+DEFAULT_PIPELINE = ['vacuum', 'analyze', 'refresh_views', 'prewarm']
+
+# Tables the catalog snapshot is built from
+SNAPSHOT_TABLES = ['acc_product', 'acc_productbatch']
+# Steps that maintain files on the local host rather than the database
+HOST_STEPS = ['catalog_snapshot']
+# Scheduler key for the periodic snapshot check of lookup-serving workers
+SNAPSHOT_WATCH = 'catalog_snapshot'
+
+
+def _tables(table):
+    return [table] + DERIVED_TABLES.get(table, [])
+
+
+def _is_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def _finished_at(run):
+    return run.started_at + timedelta(milliseconds=run.duration_ms)
+
+
+def last_activity(tables, runs=None):
+    """When the most recent sync or clear of any of `tables` finished, on any worker"""
+    if runs is None:
+        runs = SyncRun.objects.all()
+    recent = runs.filter(table__in=tables).order_by('-started_at')[:20]
+    return max((_finished_at(run) for run in recent), default=None)
+
+
+@contextmanager
+def table_lock(table):
+    """
+    Session advisory lock so one worker at a time maintains `table`.
+    Yields False when another worker holds it. Without PostgreSQL there is
+    nothing to coordinate with and the lock is always granted.
+    """
+    if not _is_postgres():
+        yield True
+        return
+    key = f"post_sync:{table}"
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", [key])
+        acquired = cursor.fetchone()[0]
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(hashtext(%s))", [key])
+
+
+def vacuum_if_needed(table):
+    """VACUUM tables whose dead tuples crossed the configured thresholds"""
+    if not _is_postgres():
+        return 'skipped'
+    min_dead = getattr(settings, 'POST_SYNC_VACUUM_MIN_DEAD', 1000)
+    ratio = getattr(settings, 'POST_SYNC_VACUUM_DEAD_RATIO', 0.2)
+
+    vacuumed = []
+    with connection.cursor() as cursor:
+        for name in _tables(table):
+            cursor.execute(
+                "SELECT n_live_tup, n_dead_tup FROM pg_stat_user_tables WHERE relname = %s",
+                [name]
+            )
+            row = cursor.fetchone()
+            if not row:
+                continue
+            live, dead = row
+            if dead >= min_dead and dead > ratio * max(live, 1):
+                cursor.execute(f"VACUUM {connection.ops.quote_name(name)}")
+                vacuumed.append(name)
+    return vacuumed
+
+
+def analyze(table):
+    if not _is_postgres():
+        return 'skipped'
+    with connection.cursor() as cursor:
+        for name in _tables(table):
+            cursor.execute(f"ANALYZE {connection.ops.quote_name(name)}")
+    return _tables(table)
+
+
+def refresh_views(table):
+    """REFRESH the materialized views configured as derived from `table`"""
+    views = getattr(settings, 'POST_SYNC_MATERIALIZED_VIEWS', {}).get(table, [])
+    if not views or not _is_postgres():
+        return 'skipped'
+    with connection.cursor() as cursor:
+        for view in views:
+            cursor.execute(f"REFRESH MATERIALIZED VIEW {connection.ops.quote_name(view)}")
+    return views
+
+
+def snapshot_is_current(snapshot):
+    """
+    True when no products or batches change finished after `snapshot` was
+    taken. Runs that rebuilt a snapshot at least as old before responding
+    are already in it.
+    """
+    if snapshot is None:
+        return False
+    changed = last_activity(
+        SNAPSHOT_TABLES,
+        SyncRun.objects.exclude(snapshot_generation__lte=snapshot.generation),
+    )
+    return changed is None or changed.timestamp() * 1e9 < snapshot.generation
+
+
+@contextmanager
+def host_lock(name):
+    """Non-blocking file lock shared by the worker processes of this host"""
+    with open(f"{snapshot_path()}.{name}.lock", 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def catalog_snapshot(table=None):
+    """
+    Rebuild this host's catalog snapshot if it is older than the latest
+    products or batches change, and pull it into the page cache
+    """
+    with host_lock('rebuild') as acquired:
+        if not acquired:
+            return 'busy'
+        if snapshot_is_current(get_snapshot()):
+            return 'up to date'
+        generation, count = write_snapshot()
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            # Touch every page once; the page cache is shared by all workers
+            for offset in range(0, len(snapshot.mm), 4096):
+                snapshot.mm[offset]
+        return {'generation': generation, 'count': count}
+
+
+def prewarm(table):
+    """
+    Load the table and its indexes into shared buffers with pg_prewarm.
+    Missing pg_prewarm is not an error.
+    """
+    if not _is_postgres():
+        return 'skipped'
+    warmed = []
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_prewarm'")
+        if cursor.fetchone():
+            for name in _tables(table):
+                cursor.execute(
+                    "SELECT pg_prewarm(c.oid) FROM pg_class c "
+                    "WHERE c.oid = %s::regclass "
+                    "OR c.oid IN (SELECT indexrelid FROM pg_index WHERE indrelid = %s::regclass)",
+                    [name, name]
+                )
+                warmed.append(name)
+    return warmed
+
+
+STEPS = {
+    'vacuum': vacuum_if_needed,
+    'analyze': analyze,
+    'refresh_views': refresh_views,
+    'catalog_snapshot': catalog_snapshot,
+    'prewarm': prewarm,
+}
+
+
+def pipeline_steps(table):
+    return getattr(settings, 'POST_SYNC_PIPELINE', {}).get(table, DEFAULT_PIPELINE)
+
+
+def run_pipeline(table, steps):
+    """Run `steps` for `table`; returns per-step timings"""
+    results = {}
+    for step in steps:
+        start = time.perf_counter()
+        try:
+            outcome = STEPS[step](table)
+            error = None
+        except Exception as e:
+            logger.error(f"Post-sync step {step} failed for {table}: {e}")
+            outcome, error = None, str(e)
+        results[step] = {
+            'ms': round((time.perf_counter() - start) * 1000, 3),
+            'result': outcome,
+            'error': error,
+        }
+    logger.info(f"Post-sync pipeline for {table} finished: {results}")
+    return results
+
+
+def maintain(table):
+    """
+    Run the pipeline for `table`: the host steps here, the database steps
+    unless another worker is already running them or nothing changed since
+    they last ran. Returns the database step results, None when there was
+    nothing to maintain, or False when another worker holds the table's lock.
+    """
+    steps = pipeline_steps(table)
+    host_steps = [step for step in steps if step in HOST_STEPS]
+    if host_steps:
+        run_pipeline(table, host_steps)
+
+    with table_lock(table) as acquired:
+        if not acquired:
+            return False
+        # Runs recorded after this point are left for the next pipeline run
+        pending = SyncRun.objects.filter(
+            table=table,
+            maintenance__isnull=True,
+            started_at__gte=timezone.now() - timedelta(days=1),
+        )
+        last_id = max(pending.values_list('pk', flat=True), default=None)
+        if last_id is None:
+            return None
+        results = run_pipeline(table, [step for step in steps if step not in HOST_STEPS])
+        pending.filter(pk__lte=last_id).update(maintenance=results)
+        return results
+
+
+class PostSyncScheduler:
+    """Single background worker per process that debounces pipelines per table"""
+
+    def __init__(self):
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._watching = False
+
+    def schedule(self, table, delay=None):
+        if delay is None:
+            delay = getattr(settings, 'POST_SYNC_DELAY', 5.0)
+        with self._condition:
+            self._pending[table] = time.monotonic() + delay
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._work, name='post-sync', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def watch_snapshot(self):
+        """Start checking this host's catalog snapshot every POST_SYNC_SNAPSHOT_INTERVAL"""
+        with self._condition:
+            if not self._watching:
+                self._watching = True
+                self.schedule(SNAPSHOT_WATCH, 0)
+
+    def _next_due(self):
+        with self._condition:
+            while True:
+                if self._pending:
+                    table, due = min(self._pending.items(), key=lambda item: item[1])
+                    wait = due - time.monotonic()
+                    if wait <= 0:
+                        del self._pending[table]
+                        return table
+                    self._condition.wait(wait)
+                else:
+                    self._condition.wait()
+
+    def _work(self):
+        while True:
+            table = self._next_due()
+            close_old_connections()
+            try:
+                if table == SNAPSHOT_WATCH:
+                    self._check_snapshot()
+                else:
+                    self._maintain(table)
+            except Exception as e:
+                logger.error(f"Post-sync pipeline for {table} failed: {e}")
+            finally:
+                connection.close()
+
+    def _quiet_for(self, tables):
+        """Seconds left until `tables` have been quiet for POST_SYNC_DELAY, else 0"""
+        delay = getattr(settings, 'POST_SYNC_DELAY', 5.0)
+        last = last_activity(tables)
+        if last is None:
+            return 0
+        return max(delay - (timezone.now() - last).total_seconds(), 0)
+
+    def _maintain(self, table):
+        # Other workers may still be receiving chunks of the same stream
+        remaining = self._quiet_for([table])
+        if remaining:
+            self.schedule(table, remaining)
+            return
+        if maintain(table) is False:
+            # The runs it picked up may not include ours, so check again later
+            self.schedule(table)
+
+    def _check_snapshot(self):
+        try:
+            if not self._quiet_for(SNAPSHOT_TABLES):
+                result = catalog_snapshot()
+                if isinstance(result, dict):
+                    logger.info(f"Catalog snapshot refreshed on this host: {result}")
+        finally:
+            self.schedule(SNAPSHOT_WATCH, getattr(settings, 'POST_SYNC_SNAPSHOT_INTERVAL', 30.0))
+
+
+scheduler = PostSyncScheduler()
+
+
+def schedule_post_sync(run):
+    """Queue maintenance for the table a successful SyncRunRecorder touched"""
+    if not getattr(settings, 'POST_SYNC_ENABLED', True):
+        return
+    if getattr(settings, 'POST_SYNC_ASYNC', True):
+        scheduler.schedule(run.table)
+    else:
+        maintain(run.table)
+
+
+def watch_catalog_snapshot():
+    """
+    Called by the catalog lookups: keeps this host's snapshot current when
+    the syncs that changed the catalog were served by another host
+    """
+    if getattr(settings, 'POST_SYNC_ENABLED', True) and getattr(settings, 'POST_SYNC_ASYNC', True):
+        scheduler.watch_snapshot()
@@ -0,0 +1,202 @@
+import logging
+import statistics
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .chunk_tuning import get_tuner
+from .models import AccMaster, AccProduct, AccProductBatch, AccUsers, SyncRun
+
+logger = logging.getLogger(__name__)
+
+SYNC_TABLES = [model._meta.db_table for model in (AccProduct, AccProductBatch, AccMaster, AccUsers)]
+
+_last_prune = None
+
+
+def get_client_id(request):
+    """
+    Identify the caller: explicit X-Client-Id header, then the JWT user_id
+    claim, then the remote address
+    """
+    client = request.META.get('HTTP_X_CLIENT_ID')
+    if client:
+        return client[:100]
+
+    token = getattr(request, 'auth', None)
+    if token is not None and hasattr(token, 'get'):
+        user_id = token.get('user_id')
+        if user_id:
+            return str(user_id)[:100]
+
+    return request.META.get('REMOTE_ADDR')
+
+
+def phase(run, name):
+    """Time a phase on `run`, or do nothing when no recorder is given"""
+    if run is None:
+        return nullcontext()
+    return run.phase(name)
+
+
+class SyncRunRecorder:
+    """
+    Context manager that writes a SyncRun row when a sync or clear finishes.
+    Exceptions are recorded and re-raised; failing to save the record never
+    fails the sync itself.
+    """
+
+    def __init__(self, model_class, mode, request):
+        self.model_class = model_class
+        self.table = model_class._meta.db_table
+        self.mode = mode
+        self.client = get_client_id(request)
+        self.bytes = int(request.META.get('CONTENT_LENGTH') or 0)
+        self.rows = 0
+        self.batch_size = None
+        self.snapshot_generation = None
+        self.phases = {}
+        self.started_at = None
+        self.record_id = None
+        self._start = None
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.phases[name] = round(self.phases.get(name, 0) + elapsed, 3)
+
+    def __enter__(self):
+        self.started_at = timezone.now()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ms = (time.perf_counter() - self._start) * 1000
+        try:
+            self.record_id = SyncRun.objects.create(
+                table=self.table,
+                mode=self.mode,
+                rows=self.rows,
+                bytes=self.bytes,
+                batch_size=self.batch_size,
+                snapshot_generation=self.snapshot_generation,
+                phases=self.phases,
+                duration_ms=round(duration_ms, 3),
+                outcome='error' if exc_type else 'success',
+                error=str(exc) if exc else None,
+                client=self.client,
+                started_at=self.started_at,
+            ).pk
+        except Exception as e:
+            logger.warning(f"Could not record sync run for {self.table}: {e}")
+        maybe_prune()
+
+        if exc_type is None and self.batch_size:
+            get_tuner(self.model_class).observe(
+                self.batch_size, self.rows, self.phases.get('insert'), self.bytes,
+                duration_ms - self.phases.get('snapshot', 0)
+            )
+        return False
+
+
+def prune_sync_runs(days=None):
+    """Delete SyncRun rows older than SYNC_RUN_RETENTION_DAYS; returns how many"""
+    if days is None:
+        days = getattr(settings, 'SYNC_RUN_RETENTION_DAYS', 90)
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted = 0
+    # Per table, so the (table, started_at) index serves the DELETE
+    for table in SYNC_TABLES:
+        deleted += SyncRun.objects.filter(table=table, started_at__lt=cutoff).delete()[0]
+    return deleted
+
+
+def maybe_prune():
+    """Prune at most once per SYNC_RUN_PRUNE_INTERVAL seconds in each process"""
+    global _last_prune
+    now = time.monotonic()
+    if _last_prune is not None and now - _last_prune < getattr(settings, 'SYNC_RUN_PRUNE_INTERVAL', 3600):
+        return
+    _last_prune = now
+    try:
+        deleted = prune_sync_runs()
+        if deleted:
+            logger.info(f"Pruned {deleted} old sync runs")
+    except Exception as e:
+        logger.warning(f"Could not prune sync runs: {e}")
+
+
+def _throughput(run):
+    if run.load_ms <= 0:
+        return None
+    return run.rows / (run.load_ms / 1000)
+
+
+def summarize_throughput(table=None, limit=50):
+    """
+    Summarize recent insert throughput per table and flag runs that fall
+    well below the rolling median of the runs before them. Runs much
+    smaller than the typical run of that mode (the short last chunk of an
+    upload) pay the fixed per-request cost over few rows, so they are not
+    judged against the baseline.
+    """
+    window = getattr(settings, 'SYNC_BASELINE_WINDOW', 20)
+    ratio = getattr(settings, 'SYNC_REGRESSION_RATIO', 0.5)
+    min_samples = getattr(settings, 'SYNC_BASELINE_MIN_SAMPLES', 5)
+    min_rows_ratio = getattr(settings, 'SYNC_BASELINE_MIN_ROWS_RATIO', 0.25)
+
+    runs = SyncRun.objects.filter(outcome='success', rows__gt=0).exclude(mode='clear')
+
+    summary = {}
+    for name in ([table] if table else SYNC_TABLES):
+        # Newest first from the index, then oldest first for the rolling baseline
+        recent = list(runs.filter(table=name).order_by('-started_at')[:limit + window])
+        if not recent:
+            continue
+        recent.reverse()
+
+        history = {}
+        evaluated = []
+        for run in recent:
+            rate = _throughput(run)
+            if rate is None:
+                continue
+            previous = history.setdefault(run.mode, [])
+            baseline = None
+            if len(previous) >= min_samples:
+                typical_rows = statistics.median(rows for _, rows in previous[-window:])
+                if run.rows >= typical_rows * min_rows_ratio:
+                    baseline = statistics.median(rate for rate, _ in previous[-window:])
+            evaluated.append({
+                'id': run.id,
+                'mode': run.mode,
+                'started_at': run.started_at,
+                'rows': run.rows,
+                'bytes': run.bytes,
+                'duration_ms': run.duration_ms,
+                'phases': run.phases,
+                'client': run.client,
+                'maintenance': run.maintenance,
+                'rows_per_sec': round(rate, 1),
+                'baseline_rows_per_sec': round(baseline, 1) if baseline else None,
+                'regression': bool(baseline and rate < baseline * ratio),
+            })
+            previous.append((rate, run.rows))
+
+        evaluated = evaluated[-limit:]
+        rates = [r['rows_per_sec'] for r in evaluated]
+        summary[name] = {
+            'runs': len(evaluated),
+            'median_rows_per_sec': round(statistics.median(rates), 1) if rates else None,
+            'last_run': evaluated[-1] if evaluated else None,
+            'regressions': [r for r in evaluated if r['regression']],
+        }
+
+    return summary
@@ -1,3 +1,708 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import JsonResponse
+from django.test import (
+    AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings,
+)
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .admission import NO_SLOT, AdmissionGate, SharedHeavySlots, TokenBucket, client_keys, gate, heavy_slots
+from .async_utils import jwt_required
+from .catalog_snapshot import CatalogSnapshot, write_snapshot
+from .chunk_tuning import DEFAULT_BATCH_SIZE, TableTuner
+from .customer_index import normalize_phone, split_phones
+from .models import AccMaster, AccProductBatch, CustomerIndex, SyncRun
+from .partitions import CODE_GUARD, is_partitioned
+from .post_sync import snapshot_is_current
+from .sync_history import SyncRunRecorder, prune_sync_runs, summarize_throughput
+
+
+def catalog_record(code, barcode=None, salesprice=None, name=None):
+    return {
+        'code': code, 'name': name, 'product': None, 'brand': None, 'unit': None,
+        'taxcode': None, 'defect': None, 'company': None, 'cost': None,
+        'salesprice': salesprice, 'bmrp': None, 'barcode': barcode,
+        'secondprice': None, 'thirdprice': None,
+    }
+
+
+class CatalogSnapshotTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'catalog.snapshot')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, records):
+        write_snapshot(path=self.path, records=records)
+        snapshot = CatalogSnapshot(self.path)
+        self.addCleanup(snapshot.mm.close)
+        return snapshot
+
+    def test_lookup_by_code_round_trip(self):
+        records = [catalog_record(f"P{i}", name=f"Lens {i}", salesprice="12.500") for i in range(500)]
+        snapshot = self.write(records)
+
+        self.assertEqual(snapshot.record_count, 500)
+        for code in ("P0", "P1", "P250", "P499"):
+            self.assertEqual(snapshot.lookup_code(code)['code'], code)
+        self.assertEqual(snapshot.lookup_code("P7")['name'], "Lens 7")
+        self.assertEqual(snapshot.lookup_code("P7")['salesprice'], "12.500")
+
+    def test_missing_keys(self):
+        snapshot = self.write([catalog_record("B"), catalog_record("D")])
+
+        # Before the first key, between keys, after the last and prefixes
+        for code in ("A", "C", "E", "", "B0", "D\0"):
+            self.assertIsNone(snapshot.lookup_code(code))
+        self.assertIsNone(snapshot.lookup_code(None))
+        self.assertIsNone(snapshot.lookup_code("x" * 100))
+        self.assertIsNone(snapshot.lookup_barcode("B"))
+
+    def test_barcode_hits(self):
+        snapshot = self.write([
+            catalog_record("P1", barcode="8901234567890"),
+            catalog_record("P2"),
+            catalog_record("P3", barcode="111"),
+        ])
+
+        self.assertEqual(snapshot.barcode_count, 2)
+        self.assertEqual(snapshot.lookup_barcode("8901234567890")['code'], "P1")
+        self.assertEqual(snapshot.lookup_barcode(" 111 ")['code'], "P3")
+        self.assertIsNone(snapshot.lookup_barcode("222"))
+
+    def test_empty_snapshot(self):
+        snapshot = self.write([])
+
+        self.assertEqual(snapshot.record_count, 0)
+        self.assertIsNone(snapshot.lookup_code("P1"))
+        self.assertIsNone(snapshot.lookup_barcode("111"))
+
+    def test_new_generation_replaces_file(self):
+        first = self.write([catalog_record("OLD")])
+        second = self.write([catalog_record("NEW")])
+
+        self.assertGreater(second.generation, first.generation)
+        self.assertNotEqual(first.identity, second.identity)
+        # The old mapping stays readable for lookups still holding it
+        self.assertEqual(first.lookup_code("OLD")['code'], "OLD")
+        self.assertIsNone(second.lookup_code("OLD"))
+
+
+class PhoneNormalizationTests(SimpleTestCase):
+    def test_normalize_phone(self):
+        for value in ("9847012345", "+91 98470-12345", "098470 12345", "0091 9847012345", "(+91) 98470 12345"):
+            self.assertEqual(normalize_phone(value), "9847012345", value)
+        self.assertEqual(normalize_phone("0484 2345678"), "4842345678")
+        self.assertIsNone(normalize_phone(""))
+        self.assertIsNone(normalize_phone(None))
+        self.assertIsNone(normalize_phone("n/a"))
+
+    def test_split_phones_separators(self):
+        self.assertEqual(split_phones("9847012345, 9847054321"), ["9847012345", "9847054321"])
+        self.assertEqual(split_phones("9847012345 / +91 98470-54321"), ["9847012345", "9847054321"])
+        self.assertEqual(split_phones("9847012345;9847054321\n0484 2345678"),
+                         ["9847012345", "9847054321", "4842345678"])
+
+    def test_split_phones_space_separated(self):
+        self.assertEqual(split_phones("9847012345 9847054321"), ["9847012345", "9847054321"])
+        # Spaces inside a single number are kept together
+        self.assertEqual(split_phones("+91 98470 12345"), ["9847012345"])
+        self.assertEqual(split_phones("98470 12345  98470 54321"), ["9847012345", "9847054321"])
+
+    def test_split_phones_empty_and_duplicates(self):
+        self.assertEqual(split_phones(None), [])
+        self.assertEqual(split_phones(" , "), [])
+        self.assertEqual(split_phones("9847012345, +919847012345"), ["9847012345"])
+
+
+@override_settings(SYNC_BASELINE_WINDOW=20, SYNC_BASELINE_MIN_SAMPLES=5, SYNC_REGRESSION_RATIO=0.5)
+class SyncHistoryTests(TestCase):
+    def setUp(self):
+        self.started_at = timezone.now() - timedelta(hours=1)
+
+    def record(self, rows, rows_per_sec, mode='chunk_insert', table='acc_productbatch', outcome='success',
+               snapshot_ms=0):
+        self.started_at += timedelta(seconds=1)
+        return SyncRun.objects.create(
+            table=table, mode=mode, rows=rows, duration_ms=rows / rows_per_sec * 1000 + snapshot_ms,
+            phases={'snapshot': snapshot_ms} if snapshot_ms else {},
+            outcome=outcome, started_at=self.started_at,
+        )
+
+    def upload(self, rows_per_sec=13000):
+        """Four full chunks and the short last one"""
+        for _ in range(4):
+            self.record(2000, rows_per_sec)
+        return self.record(7, 2500)
+
+    def test_short_last_chunk_is_not_a_regression(self):
+        for _ in range(3):
+            self.upload()
+        summary = summarize_throughput()['acc_productbatch']
+        self.assertEqual(summary['runs'], 15)
+        self.assertEqual(summary['regressions'], [])
+        self.assertIsNone(summary['last_run']['baseline_rows_per_sec'])
+
+    def test_slow_full_chunk_is_a_regression(self):
+        for _ in range(2):
+            self.upload()
+        slow = self.record(2000, 4000)
+        regressions = summarize_throughput()['acc_productbatch']['regressions']
+        self.assertEqual([r['id'] for r in regressions], [slow.id])
+        self.assertEqual(regressions[0]['baseline_rows_per_sec'], 13000)
+
+    def test_baseline_needs_min_samples_and_is_per_mode(self):
+        for _ in range(4):
+            self.record(2000, 13000)
+        self.record(2000, 1000, mode='clear_and_insert')
+        self.record(2000, 1000)
+        self.assertEqual(summarize_throughput()['acc_productbatch']['regressions'], [])
+
+    def test_snapshot_rebuild_is_left_out_of_throughput(self):
+        for _ in range(5):
+            self.record(2000, 13000)
+        self.record(2000, 13000, snapshot_ms=900)
+        summary = summarize_throughput()['acc_productbatch']
+        self.assertEqual(summary['regressions'], [])
+        self.assertEqual(summary['last_run']['rows_per_sec'], 13000)
+
+    def test_recorder_reports_load_time_to_tuner(self):
+        request = RequestFactory().post('/api/sync/products/chunk')
+        with mock.patch('api.sync_history.get_tuner') as get_tuner:
+            with SyncRunRecorder(AccProductBatch, 'chunk_insert', request) as run:
+                run.rows = 2000
+                run.batch_size = 1000
+                with run.phase('snapshot'):
+                    time.sleep(0.05)
+        duration_ms = get_tuner.return_value.observe.call_args.args[4]
+        self.assertLess(duration_ms, 50)
+        self.assertGreaterEqual(SyncRun.objects.get().duration_ms, 50)
+
+    def test_tables_without_runs_and_failures_are_left_out(self):
+        self.record(2000, 13000, table='acc_product', outcome='error')
+        self.record(100, 1000, table='acc_users')
+        self.assertEqual(list(summarize_throughput()), ['acc_users'])
+        self.assertEqual(summarize_throughput(table='acc_product'), {})
+
+    @override_settings(SYNC_RUN_RETENTION_DAYS=30)
+    def test_prune_sync_runs(self):
+        self.started_at = timezone.now() - timedelta(days=31)
+        old = self.record(10, 100)
+        self.started_at = timezone.now() - timedelta(days=29)
+        kept = self.record(10, 100)
+        self.assertEqual(prune_sync_runs(), 1)
+        self.assertEqual(list(SyncRun.objects.values_list('pk', flat=True)), [kept.pk])
+        self.assertFalse(SyncRun.objects.filter(pk=old.pk).exists())
+
+
+class TableTunerTests(SimpleTestCase):
+    def setUp(self):
+        # 20 columns allow batches up to 3276 rows
+        self.tuner = TableTuner(20)
+
+    def measure(self, batch_size, ms_per_row, times=3):
+        for _ in range(times):
+            self.tuner.observe(batch_size, batch_size * 2, batch_size * 2 * ms_per_row, None, None)
+
+    def test_candidates_respect_parameter_limit(self):
+        self.assertEqual(self.tuner.candidates, [250, 500, 1000, 2000])
+
+    def test_best_batch_size(self):
+        self.assertEqual(self.tuner.best_batch_size(), DEFAULT_BATCH_SIZE)
+        self.measure(1000, 0.2)
+        self.measure(500, 0.1)
+        self.measure(2000, 0.3, times=2)
+        self.assertEqual(self.tuner.best_batch_size(), 500)
+
+    def test_untried_neighbours_are_explored(self):
+        self.measure(1000, 0.2)
+        self.assertEqual(self.tuner.batch_size(5000), 500)
+        self.measure(500, 0.3)
+        self.assertEqual(self.tuner.batch_size(5000), 2000)
+        # Batches larger than the insert are never tried
+        with mock.patch('api.chunk_tuning.random.random', return_value=0.5):
+            self.assertEqual(self.tuner.batch_size(1500), 1000)
+
+    def test_measured_neighbours_are_explored_occasionally(self):
+        self.measure(500, 0.3)
+        self.measure(1000, 0.2)
+        self.measure(2000, 0.3)
+        with mock.patch('api.chunk_tuning.random.random', return_value=0.5):
+            self.assertEqual(self.tuner.batch_size(5000), 1000)
+        with mock.patch('api.chunk_tuning.random.random', return_value=0.01), \
+                mock.patch('api.chunk_tuning.random.choice', side_effect=lambda sizes: sizes[-1]) as choice:
+            self.assertEqual(self.tuner.batch_size(5000), 2000)
+        choice.assert_called_once_with([500, 1000, 2000])
+
+    def test_chunks_smaller_than_the_batch_are_ignored(self):
+        self.tuner.observe(1000, 7, 5, 700, 40)
+        self.assertEqual(self.tuner.samples, {})
+        self.assertEqual(self.tuner.cost, {})
+        self.assertEqual(self.tuner.bytes_per_row, 100)
+
+    def test_recommendation_is_whole_batches(self):
+        # 2 MB at 150 bytes a row allows 13333 rows; 10000 rows/sec for 2s allows 20000
+        self.tuner.observe(1000, 1000, 50, 150_000, 100)
+        recommendation = self.tuner.recommendation()
+        self.assertEqual(recommendation['batch_size'], 1000)
+        self.assertEqual(recommendation['rows'], 13000)
+        self.assertEqual(recommendation['bytes'], 13000 * 150)
+
+    def test_recommendation_below_one_batch(self):
+        self.tuner.observe(1000, 1000, 50, 150_000, 20_000)
+        self.assertEqual(self.tuner.recommendation()['rows'], 100)
+
+
+@jwt_required
+async def whoami(request):
+    return JsonResponse({'user': request.user.username, 'token_user': request.auth['user_id']})
+
+
+class JwtRequiredTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='counter1')
+
+    def get(self, token=None):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        return AsyncRequestFactory().get('/api/catalog/code/X', headers=headers)
+
+    async def test_valid_token(self):
+        response = await whoami(self.get(AccessToken.for_user(self.user)))
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONEqual(response.content, {'user': 'counter1', 'token_user': self.user.pk})
+
+    async def test_missing_credentials(self):
+        response = await whoami(self.get())
+        self.assertEqual(response.status_code, 401)
+        self.assertJSONEqual(response.content, {'detail': 'Authentication credentials were not provided.'})
+
+    async def test_invalid_token(self):
+        response = await whoami(self.get('not-a-token'))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.content)['code'], 'token_not_valid')
+
+    async def test_token_without_user_claim(self):
+        token = AccessToken.for_user(self.user)
+        del token['user_id']
+        response = await whoami(self.get(token))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.content)['code'], 'token_not_valid')
+
+    async def test_unknown_and_inactive_users(self):
+        token = AccessToken.for_user(self.user)
+        self.user.is_active = False
+        await self.user.asave()
+        response = await whoami(self.get(token))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.content)['detail'], 'User is inactive')
+
+        await self.user.adelete()
+        response = await whoami(self.get(token))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.content)['detail'], 'User not found')
+
+
+class SnapshotFreshnessTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.snapshot = SimpleNamespace(generation=int(self.now.timestamp() * 1e9))
+
+    def record(self, seconds, table='acc_product', snapshot_generation=None):
+        return SyncRun.objects.create(
+            table=table, mode='clear_and_insert', rows=1, duration_ms=10, outcome='success',
+            started_at=self.now + timedelta(seconds=seconds), snapshot_generation=snapshot_generation,
+        )
+
+    def test_missing_snapshot_is_stale(self):
+        self.assertFalse(snapshot_is_current(None))
+
+    def test_changes_before_the_snapshot(self):
+        self.record(-5)
+        self.record(5, table='acc_master')
+        self.assertTrue(snapshot_is_current(self.snapshot))
+
+    def test_change_after_the_snapshot(self):
+        self.record(5, table='acc_productbatch')
+        self.assertFalse(snapshot_is_current(self.snapshot))
+
+    def test_sync_that_wrote_this_snapshot(self):
+        self.record(-1, snapshot_generation=self.snapshot.generation)
+        self.assertTrue(snapshot_is_current(self.snapshot))
+
+    def test_sync_whose_snapshot_write_failed(self):
+        self.record(-1)
+        self.record(1)
+        self.assertFalse(snapshot_is_current(self.snapshot))
+
+    def test_newer_snapshot_written_on_another_host(self):
+        self.record(1, snapshot_generation=self.snapshot.generation + 2 * 10 ** 9)
+        self.assertFalse(snapshot_is_current(self.snapshot))
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_refill_is_capped_at_burst(self):
+        bucket = TokenBucket(rate=2, burst=5)
+        bucket.tokens = 0
+        bucket.refill(bucket.updated + 1)
+        self.assertEqual(bucket.tokens, 2)
+        bucket.refill(bucket.updated + 60)
+        self.assertEqual(bucket.tokens, 5)
+
+    def test_wait(self):
+        bucket = TokenBucket(rate=4, burst=5)
+        self.assertEqual(bucket.wait(), 0)
+        bucket.tokens = 0.5
+        self.assertAlmostEqual(bucket.wait(), 0.125)
+
+
+@override_settings(
+    ADMISSION_RATES={'light': (1, 2)}, ADMISSION_ADDRESS_SHARE=1,
+    ADMISSION_MAX_HEAVY=1, ADMISSION_HEAVY_QUEUE=2, ADMISSION_HEAVY_TIMEOUT=5.0,
+    ADMISSION_CONCURRENCY=8, ADMISSION_LIGHT_BUSY=0.5,
+)
+class AdmissionGateTests(SimpleTestCase):
+    def setUp(self):
+        self.gate = AdmissionGate()
+
+    def test_rate_limit_charges_all_buckets_or_none(self):
+        self.assertEqual(self.gate.rate_limit('light', ['addr:a', 'client:x']), 0)
+        self.assertEqual(self.gate.rate_limit('light', ['addr:a', 'client:x']), 0)
+        self.assertGreater(self.gate.rate_limit('light', ['addr:a', 'client:y']), 0)
+        # client:y was not charged for the rejected request
+        self.assertEqual(self.gate.rate_limit('light', ['addr:b', 'client:y']), 0)
+        self.assertEqual(self.gate.counters['rejected_rate_limit'], 1)
+
+    def test_heavy_slots_and_release(self):
+        self.assertEqual(self.gate.acquire_heavy(), 0)
+        self.assertEqual(self.gate.heavy_active, 1)
+        self.gate.release_heavy(2.0)
+        self.assertEqual(self.gate.heavy_active, 0)
+        self.assertEqual(self.gate.heavy_seconds, 2.0)
+
+    @override_settings(ADMISSION_CONCURRENCY=6)
+    def test_threaded_queue_leaves_threads_for_light_requests(self):
+        # 6 threads - 1 heavy slot - 3 for light traffic = 2 may queue
+        self.assertEqual(self.gate._queue_limit(threaded=True), 2)
+        with override_settings(ADMISSION_CONCURRENCY=2):
+            self.assertEqual(self.gate._queue_limit(threaded=True), 0)
+            self.assertEqual(self.gate.acquire_heavy(), 0)
+            self.assertGreater(self.gate.acquire_heavy(), 0)
+        self.assertEqual(self.gate.counters['rejected_queue_full'], 1)
+        self.assertEqual(self.gate.heavy_waiting, 0)
+
+    def test_threaded_waiter_gets_released_slot(self):
+        self.assertEqual(self.gate.acquire_heavy(), 0)
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(self.gate.acquire_heavy()))
+        waiter.start()
+        while not self.gate.heavy_waiting:
+            time.sleep(0.001)
+        self.gate.release_heavy(1.0)
+        waiter.join(5)
+        self.assertEqual(results, [0])
+        self.assertEqual((self.gate.heavy_active, self.gate.heavy_waiting), (1, 0))
+
+    @override_settings(ADMISSION_MAX_HEAVY=4)
+    def test_light_traffic_halves_heavy_slots(self):
+        for _ in range(3):
+            self.gate.enter_light()
+        self.assertEqual(self.gate._heavy_limit(), 4)
+        self.gate.enter_light()
+        self.assertEqual(self.gate._heavy_limit(), 2)
+        self.gate.exit_light()
+        self.assertEqual(self.gate._heavy_limit(), 4)
+
+    def test_async_waiter_gets_released_slot(self):
+        async def scenario():
+            self.assertEqual(await self.gate.aacquire_heavy(), 0)
+            waiter = asyncio.ensure_future(self.gate.aacquire_heavy())
+            await asyncio.sleep(0)
+            self.assertEqual(self.gate.heavy_waiting, 1)
+            self.gate.release_heavy(1.0)
+            self.assertEqual(await waiter, 0)
+        asyncio.run(scenario())
+        self.assertEqual(self.gate.heavy_active, 1)
+        self.assertEqual(self.gate.heavy_waiting, 0)
+
+    @override_settings(ADMISSION_HEAVY_TIMEOUT=0.01)
+    def test_async_waiter_times_out(self):
+        async def scenario():
+            await self.gate.aacquire_heavy()
+            return await self.gate.aacquire_heavy()
+        self.assertGreater(asyncio.run(scenario()), 0)
+        self.assertEqual(self.gate.counters['rejected_timeout'], 1)
+        self.assertEqual((self.gate.heavy_active, self.gate.heavy_waiting), (1, 0))
+
+    def test_cancelled_while_queued(self):
+        async def scenario():
+            await self.gate.aacquire_heavy()
+            waiter = asyncio.ensure_future(self.gate.aacquire_heavy())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+        asyncio.run(scenario())
+        self.assertEqual((self.gate.heavy_active, self.gate.heavy_waiting), (1, 0))
+
+    def test_cancelled_after_slot_was_handed_over(self):
+        async def scenario():
+            await self.gate.aacquire_heavy()
+            waiter = asyncio.ensure_future(self.gate.aacquire_heavy())
+            await asyncio.sleep(0)
+            # The slot goes to the waiter, which is cancelled before it runs
+            self.gate.release_heavy(1.0)
+            self.assertEqual(self.gate.heavy_active, 1)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+        asyncio.run(scenario())
+        self.assertEqual((self.gate.heavy_active, self.gate.heavy_waiting), (0, 0))
+
+
+    def test_rejected_for_shared_slot(self):
+        self.assertEqual(self.gate.acquire_heavy(), 0)
+        self.assertGreater(self.gate.reject_heavy(), 0)
+        self.assertEqual(self.gate.heavy_active, 0)
+        self.assertEqual(self.gate.counters['rejected_shared_busy'], 1)
+
+    @override_settings(ADMISSION_SHARED_HEAVY=False)
+    def test_shared_slots_can_be_turned_off(self):
+        self.assertEqual(SharedHeavySlots().acquire(1.0), NO_SLOT)
+
+
+@skipIf(settings.ASGI_SERVER, "checks the WSGI defaults")
+class AdmissionDefaultsTests(SimpleTestCase):
+    def test_wsgi_defaults_allow_a_heavy_queue(self):
+        self.assertGreater(AdmissionGate()._queue_limit(threaded=True), 0)
+
+
+@skipUnless(connection.vendor == 'postgresql', "shared heavy slots need PostgreSQL")
+@override_settings(ADMISSION_MAX_HEAVY=2)
+class SharedHeavySlotsTests(SimpleTestCase):
+    databases = {'default'}
+
+    def setUp(self):
+        # Two instances stand in for two worker processes
+        self.first = SharedHeavySlots()
+        self.second = SharedHeavySlots()
+
+    def tearDown(self):
+        for slots in (self.first, self.second, heavy_slots):
+            with slots._lock:
+                slots._reset()
+
+    def test_slots_are_shared_between_processes(self):
+        self.assertEqual(self.first.acquire(0), 0)
+        self.assertEqual(self.second.acquire(0), 1)
+        self.assertIsNone(self.first.try_acquire())
+        self.assertIsNone(self.second.acquire(0.05))
+        self.first.release(0)
+        self.assertEqual(self.second.try_acquire(), 0)
+        self.assertEqual(self.second.held, {0, 1})
+
+    def test_async_acquire_and_release(self):
+        async def scenario():
+            self.assertEqual(await self.first.aacquire(0), 0)
+            self.assertEqual(await self.first.aacquire(0), 1)
+            self.assertIsNone(await self.second.aacquire(0.05))
+            await self.first.arelease(1)
+            return await self.second.aacquire(0)
+        self.assertEqual(asyncio.run(scenario()), 1)
+
+    def test_heavy_request_frees_its_shared_slot(self):
+        self.first.acquire(0)
+        with mock.patch.object(heavy_slots, 'release', wraps=heavy_slots.release) as release:
+            self.client.post('/api/sync/masters/chunk', [], content_type='application/json')
+        release.assert_called_once_with(1)
+        self.assertEqual(heavy_slots.held, set())
+        self.assertEqual(self.second.try_acquire(), 1)
+
+    @override_settings(ADMISSION_HEAVY_TIMEOUT=0.05)
+    def test_heavy_request_waits_for_shared_slot(self):
+        self.first.acquire(0)
+        self.first.acquire(0)
+        rejected = gate.counters['rejected_shared_busy']
+        response = self.client.post('/api/sync/masters/chunk', [], content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(gate.counters['rejected_shared_busy'], rejected + 1)
+        self.assertEqual(gate.heavy_active, 0)
+
+    @override_settings(ADMISSION_HEAVY_TIMEOUT=0.05)
+    async def test_async_heavy_request_waits_for_shared_slot(self):
+        await self.first.aacquire(0)
+        response = await self.async_client.post('/api/sync/masters/chunk', [], content_type='application/json')
+        self.assertNotEqual(response.status_code, 429)
+        self.assertEqual(heavy_slots.held, set())
+        await self.first.aacquire(0)
+        response = await self.async_client.post('/api/sync/masters/chunk', [], content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(gate.heavy_active, 0)
+
+
+@override_settings(ADMISSION_TRUSTED_PROXIES=['10.0.0.1'])
+class ClientKeysTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_direct_client_ignores_forwarded_header(self):
+        request = self.factory.post('/app1/login/', REMOTE_ADDR='203.0.113.5', HTTP_X_FORWARDED_FOR='1.2.3.4')
+        self.assertEqual(client_keys(request), ['addr:203.0.113.5'])
+
+    def test_address_behind_trusted_proxy(self):
+        request = self.factory.post(
+            '/app1/login/', REMOTE_ADDR='10.0.0.1',
+            HTTP_X_FORWARDED_FOR='1.2.3.4, 198.51.100.7', HTTP_X_CLIENT_ID='pos-1',
+        )
+        self.assertEqual(client_keys(request), ['addr:198.51.100.7', 'client:pos-1'])
+
+
+@skipUnless(connection.vendor == 'postgresql', "acc_master partitioning needs PostgreSQL")
+@override_settings(ACC_MASTER_PARTITIONED=True, POST_SYNC_ENABLED=False, ADMISSION_CONTROL_ENABLED=False)
+class PartitionedMastersTests(TransactionTestCase):
+    def setUp(self):
+        with connection.schema_editor() as editor:
+            editor.create_model(AccMaster)
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE INDEX acc_master_name ON acc_master (name)")
+        AccMaster.objects.bulk_create([
+            AccMaster(code='C1', name='Ravi', super_code='DEBTO', phone='9847055555'),
+            AccMaster(code='C2', name='Anu', super_code='DEBTO'),
+            AccMaster(code='S1', name='Supplier', super_code='CREDI'),
+        ])
+        self.api = APIClient()
+        self.api.force_authenticate(User.objects.create(username='sync'))
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS acc_master, acc_master_unpartitioned, {CODE_GUARD} CASCADE")
+            cursor.execute(f"DROP FUNCTION IF EXISTS {CODE_GUARD}_sync() CASCADE")
+
+    def partition(self):
+        call_command('partition_acc_master', stdout=StringIO())
+
+    def codes(self, super_code):
+        return set(AccMaster.objects.filter(super_code=super_code).values_list('code', flat=True))
+
+    def guard(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT code, super_code FROM {CODE_GUARD}")
+            return set(cursor.fetchall())
+
+    def leftover_tables(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT relname FROM pg_class WHERE relname ~ '^acc_master_debto_(stage|old)_'")
+            return cursor.fetchall()
+
+    def test_partition_keeps_rows_and_indexes(self):
+        self.partition()
+        self.assertTrue(is_partitioned('acc_master'))
+        self.assertEqual(self.codes('DEBTO'), {'C1', 'C2'})
+        self.assertEqual(self.codes('CREDI'), {'S1'})
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM acc_master_debto")
+            self.assertEqual(cursor.fetchone()[0], 2)
+            cursor.execute(
+                "SELECT pg_get_constraintdef(oid) FROM pg_constraint "
+                "WHERE conrelid = 'acc_master'::regclass AND contype = 'p'"
+            )
+            self.assertEqual(cursor.fetchone()[0], 'PRIMARY KEY (code, super_code)')
+            cursor.execute("SELECT indexdef FROM pg_indexes WHERE indexname = 'acc_master_name'")
+            self.assertIn('ON ONLY public.acc_master USING btree (name)', cursor.fetchone()[0])
+        self.assertEqual(self.guard(), {('C1', 'DEBTO'), ('C2', 'DEBTO'), ('S1', 'CREDI')})
+
+    def test_syncs_and_clear_on_partitioned_masters(self):
+        self.partition()
+
+        response = self.api.post('/api/sync/masters/v2', [
+            {'code': 'C2', 'name': 'Anu K', 'super_code': 'DEBTO'},
+            {'code': 'C3', 'name': 'Babu', 'super_code': 'DEBTO', 'phone': '9847066666'},
+        ], format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['count'], 2)
+        self.assertEqual(self.codes('DEBTO'), {'C2', 'C3'})
+        self.assertEqual(self.codes('CREDI'), {'S1'})
+        self.assertEqual(set(CustomerIndex.objects.values_list('code', flat=True)), {'C2', 'C3'})
+        self.assertEqual(self.guard(), {('C2', 'DEBTO'), ('C3', 'DEBTO'), ('S1', 'CREDI')})
+        self.assertEqual(self.leftover_tables(), [])
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'acc_master_debto'")
+            self.assertEqual(
+                {name for (name,) in cursor.fetchall()},
+                {'acc_master_debto_pkey', 'acc_master_debto_name_idx'}
+            )
+
+        response = self.api.post('/api/sync/masters/chunk', [
+            {'code': 'C4', 'name': 'Devi', 'super_code': 'DEBTO'},
+        ], format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertIn(('C4', 'DEBTO'), self.guard())
+
+        response = self.api.delete('/api/clear/masters')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['deleted'], 3)
+        self.assertEqual(self.codes('DEBTO'), set())
+        self.assertEqual(self.codes('CREDI'), {'S1'})
+        self.assertEqual(self.guard(), {('S1', 'CREDI')})
+
+        # Codes freed by the clear can be used again
+        response = self.api.post('/api/sync/masters/chunk', [
+            {'code': 'C2', 'name': 'Anu', 'super_code': 'DEBTO'},
+        ], format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.codes('DEBTO'), {'C2'})
+
+    def test_code_used_by_another_ledger_is_rejected(self):
+        self.partition()
+
+        response = self.api.post('/api/sync/masters/v2', [
+            {'code': 'C9', 'name': 'New', 'super_code': 'DEBTO'},
+            {'code': 'S1', 'name': 'Clash', 'super_code': 'DEBTO'},
+        ], format='json')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.codes('DEBTO'), {'C1', 'C2'})
+        self.assertEqual(self.leftover_tables(), [])
+        self.assertEqual(self.guard(), {('C1', 'DEBTO'), ('C2', 'DEBTO'), ('S1', 'CREDI')})
+
+        response = self.api.post('/api/sync/masters/chunk', [
+            {'code': 'S1', 'name': 'Clash', 'super_code': 'DEBTO'},
+        ], format='json')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.codes('DEBTO'), {'C1', 'C2'})
+
+    def test_refuses_dependent_objects(self):
+        dependents = [
+            ("CREATE VIEW debtors AS SELECT code FROM acc_master", "DROP VIEW debtors"),
+            ("CREATE TABLE ledger (code varchar(30) REFERENCES acc_master (code))", "DROP TABLE ledger"),
+            ("CREATE FUNCTION noop() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN RETURN NEW; END $$; "
+             "CREATE TRIGGER audit BEFORE INSERT ON acc_master FOR EACH ROW EXECUTE FUNCTION noop()",
+             "DROP FUNCTION noop() CASCADE"),
+            ("ALTER TABLE acc_master ENABLE ROW LEVEL SECURITY", "ALTER TABLE acc_master DISABLE ROW LEVEL SECURITY"),
+            ("CREATE POLICY branch ON acc_master USING (true)", "DROP POLICY branch ON acc_master"),
+        ]
+        for create, drop in dependents:
+            with self.subTest(create=create), connection.cursor() as cursor:
+                cursor.execute(create)
+                with self.assertRaisesMessage(CommandError, "dependent objects"):
+                    self.partition()
+                cursor.execute(drop)
+        self.assertFalse(is_partitioned('acc_master'))
+        self.partition()
+        self.assertTrue(is_partitioned('acc_master'))
@@ -22,4 +22,17 @@ urlpatterns = [
     path('sync/productbatches/v2', views.sync_productbatches_v2, name='sync_productbatches_v2'),
     path('sync/masters/v2', views.sync_masters_v2, name='sync_masters_v2'),
     path('sync/users/v2', views.sync_users_v2, name='sync_users_v2'),
+    
+    # Sync run history and throughput regression report
+    path('sync/history', views.sync_history, name='sync_history'),
+    path('sync/chunking', views.sync_chunking, name='sync_chunking'),
+    path('admission/stats', views.admission_stats, name='admission_stats'),
+    
+    # Catalog snapshot (rebuild after chunked uploads) and lookups
+    path('sync/catalog/snapshot', views.sync_catalog_snapshot, name='sync_catalog_snapshot'),
+    path('catalog/code/<str:code>', views.catalog_by_code, name='catalog_by_code'),
+    path('catalog/barcode/<str:barcode>', views.catalog_by_barcode, name='catalog_by_barcode'),
+    
+    # Customer (DEBTO master) lookup by phone / name prefix
+    path('customers/lookup', views.customer_lookup, name='customer_lookup'),
 ]
\ No newline at end of file
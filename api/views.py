@@ -2,7 +2,8 @@ from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
 from django.db import transaction, connection
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_GET
 from .models import AccProduct, AccProductBatch, AccMaster, AccUsers
 from .serializers import (
     AccProductSerializer,
@@ -10,28 +11,41 @@ from .serializers import (
     AccMasterSerializer,
     AccUsersSerializer,
 )
+from .sync_history import SyncRunRecorder, phase, summarize_throughput
+from .chunk_tuning import batch_size_for, recommend
+from .admission import gate, heavy_slots
+from .catalog_snapshot import get_snapshot, write_snapshot, PRODUCT_FIELDS, BATCH_FIELDS
+from .customer_index import add_customers, rebuild_customers, afind_customers
+from .post_sync import schedule_post_sync, watch_catalog_snapshot
+from .partitions import replace_partition, truncate_scoped
+from .async_utils import jwt_required, on_write_executor
 import logging
 from django.db import transaction
 
 logger = logging.getLogger(__name__)
 
 
-def bulk_insert_with_clear(model_class, serializer_class, data, filter_kwargs=None):
+def delete_rows(model_class, filter_kwargs=None):
+    """
+    Delete all rows, or the rows matching filter_kwargs. Scoped clears of a
+    partitioned acc_master truncate the partition instead.
+    """
+    if filter_kwargs:
+        truncated = truncate_scoped(model_class, filter_kwargs)
+        if truncated is not None:
+            return truncated
+        return model_class.objects.filter(**filter_kwargs).delete()[0]
+    return model_class.objects.all().delete()[0]
+
+
+def bulk_insert_with_clear(model_class, serializer_class, data, filter_kwargs=None, run=None, after_write=None):
     """
     Clear existing data first, then bulk insert new data
     """
     try:
-        with transaction.atomic():
-            # Step 1: Clear existing data
-            if filter_kwargs:
-                deleted_count = model_class.objects.filter(**filter_kwargs).delete()[0]
-            else:
-                deleted_count = model_class.objects.all().delete()[0]
-            
-            logger.info(f"Cleared {deleted_count} existing records from {model_class.__name__}")
-            
-            # Step 2: Prepare new instances
-            instances = []
+        # Step 1: Prepare new instances
+        instances = []
+        with phase(run, "prepare"):
             for item in data:
                 try:
                     instance = model_class(**item)
@@ -39,13 +53,34 @@ def bulk_insert_with_clear(model_class, serializer_class, data, filter_kwargs=No
                 except Exception as e:
                     logger.warning(f"Skipping invalid record: {e}")
                     continue
+        
+        # Scoped syncs of a partitioned acc_master swap in a staging table
+        swapped = replace_partition(model_class, filter_kwargs, instances, run=run, after_write=after_write)
+        if swapped is not None:
+            return swapped
+        
+        with transaction.atomic():
+            # Step 2: Clear existing data
+            with phase(run, "clear"):
+                deleted_count = delete_rows(model_class, filter_kwargs)
+            
+            logger.info(f"Cleared {deleted_count} existing records from {model_class.__name__}")
+            
+            # Keep derived indexes in the same transaction as the table
+            if after_write:
+                with phase(run, "index"):
+                    after_write(instances)
             
             # Step 3: Bulk create new records
             if instances:
-                created_objects = model_class.objects.bulk_create(
-                    instances, 
-                    batch_size=1000
-                )
+                batch_size = batch_size_for(model_class, len(instances))
+                if run:
+                    run.batch_size = batch_size
+                with phase(run, "insert"):
+                    created_objects = model_class.objects.bulk_create(
+                        instances, 
+                        batch_size=batch_size
+                    )
                 logger.info(f"Created {len(created_objects)} new records in {model_class.__name__}")
                 return len(created_objects)
             else:
@@ -57,7 +92,7 @@ def bulk_insert_with_clear(model_class, serializer_class, data, filter_kwargs=No
         raise
 
 
-def bulk_insert_only(model_class, data):
+def bulk_insert_only(model_class, data, run=None, after_write=None):
     """
     Insert data without clearing (for chunked uploads)
     """
@@ -65,20 +100,30 @@ def bulk_insert_only(model_class, data):
         with transaction.atomic():
             # Prepare new instances
             instances = []
-            for item in data:
-                try:
-                    instance = model_class(**item)
-                    instances.append(instance)
-                except Exception as e:
-                    logger.warning(f"Skipping invalid record: {e}")
-                    continue
+            with phase(run, "prepare"):
+                for item in data:
+                    try:
+                        instance = model_class(**item)
+                        instances.append(instance)
+                    except Exception as e:
+                        logger.warning(f"Skipping invalid record: {e}")
+                        continue
+            
+            # Keep derived indexes in the same transaction as the table
+            if after_write:
+                with phase(run, "index"):
+                    after_write(instances)
             
             # Bulk create new records
             if instances:
-                created_objects = model_class.objects.bulk_create(
-                    instances, 
-                    batch_size=1000
-                )
+                batch_size = batch_size_for(model_class, len(instances))
+                if run:
+                    run.batch_size = batch_size
+                with phase(run, "insert"):
+                    created_objects = model_class.objects.bulk_create(
+                        instances, 
+                        batch_size=batch_size
+                    )
                 logger.info(f"Created {len(created_objects)} new records in {model_class.__name__}")
                 return len(created_objects)
             else:
@@ -90,16 +135,16 @@ def bulk_insert_only(model_class, data):
         raise
 
 
-def clear_table(model_class, filter_kwargs=None):
+def clear_table(model_class, filter_kwargs=None, run=None, after_write=None):
     """
     Clear table data only
     """
     try:
-        with transaction.atomic():
-            if filter_kwargs:
-                deleted_count = model_class.objects.filter(**filter_kwargs).delete()[0]
-            else:
-                deleted_count = model_class.objects.all().delete()[0]
+        with transaction.atomic(), phase(run, "clear"):
+            deleted_count = delete_rows(model_class, filter_kwargs)
+            
+            if after_write:
+                after_write([])
             
             logger.info(f"Cleared {deleted_count} existing records from {model_class.__name__}")
             return deleted_count
@@ -109,55 +154,101 @@ def clear_table(model_class, filter_kwargs=None):
         raise
 
 
+def refresh_catalog_snapshot(run=None):
+    """
+    Rebuild the shared catalog snapshot after a whole-table products or
+    prices sync, so lookups see it as soon as the sync returns. Chunked
+    streams are left to the post-sync pipeline.
+    """
+    try:
+        with phase(run, "snapshot"):
+            generation, count = write_snapshot()
+    except Exception as e:
+        # Left for the post-sync pipeline, which sees no generation on the run
+        logger.error(f"Catalog snapshot rebuild failed: {e}")
+        return None
+    if run:
+        run.snapshot_generation = generation
+    return generation, count
+
+
+def parse_limit(value, default):
+    """A positive integer `limit` query parameter, or None if it is invalid"""
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        return None
+    return limit if limit >= 1 else None
+
+
 # Home URL
 def home(request):
     return HttpResponse("Welcome to the Global-Glass Sync API 🚀")
 
 
+@on_write_executor
 @api_view(['DELETE'])
 def clear_products(request):
     """Clear products table"""
     try:
-        deleted_count = clear_table(AccProduct)
+        with SyncRunRecorder(AccProduct, "clear", request) as run:
+            deleted_count = clear_table(AccProduct, run=run)
+            run.rows = deleted_count
+        schedule_post_sync(run)
         return Response({"message": "Products cleared successfully", "deleted": deleted_count})
     except Exception as e:
         logger.exception("Error clearing products")
         return Response({"error": str(e)}, status=500)
 
 
+@on_write_executor
 @api_view(['DELETE'])
 def clear_productbatches(request):
     """Clear product batches table"""
     try:
-        deleted_count = clear_table(AccProductBatch)
+        with SyncRunRecorder(AccProductBatch, "clear", request) as run:
+            deleted_count = clear_table(AccProductBatch, run=run)
+            run.rows = deleted_count
+        schedule_post_sync(run)
         return Response({"message": "Product batches cleared successfully", "deleted": deleted_count})
     except Exception as e:
         logger.exception("Error clearing product batches")
         return Response({"error": str(e)}, status=500)
 
 
+@on_write_executor
 @api_view(['DELETE'])
 def clear_masters(request):
     """Clear masters table"""
     try:
-        deleted_count = clear_table(AccMaster, filter_kwargs={"super_code": "DEBTO"})
+        with SyncRunRecorder(AccMaster, "clear", request) as run:
+            deleted_count = clear_table(AccMaster, filter_kwargs={"super_code": "DEBTO"}, run=run, after_write=rebuild_customers)
+            run.rows = deleted_count
+        schedule_post_sync(run)
         return Response({"message": "Masters cleared successfully", "deleted": deleted_count})
     except Exception as e:
         logger.exception("Error clearing masters")
         return Response({"error": str(e)}, status=500)
 
 
+@on_write_executor
 @api_view(['DELETE'])
 def clear_users(request):
     """Clear users table"""
     try:
-        deleted_count = clear_table(AccUsers)
+        with SyncRunRecorder(AccUsers, "clear", request) as run:
+            deleted_count = clear_table(AccUsers, run=run)
+            run.rows = deleted_count
+        schedule_post_sync(run)
         return Response({"message": "Users cleared successfully", "deleted": deleted_count})
     except Exception as e:
         logger.exception("Error clearing users")
         return Response({"error": str(e)}, status=500)
 
 
+@on_write_executor
 @api_view(['POST'])
 def sync_products_chunk(request):
     """
@@ -167,19 +258,24 @@ def sync_products_chunk(request):
         data_count = len(request.data) if hasattr(request.data, '__len__') else 0
         logger.info(f"Inserting chunk of {data_count} products")
         
-        count = bulk_insert_only(AccProduct, request.data)
+        with SyncRunRecorder(AccProduct, "chunk_insert", request) as run:
+            count = bulk_insert_only(AccProduct, request.data, run=run)
+            run.rows = count
+        schedule_post_sync(run)
         
         logger.info(f"Successfully inserted {count} products")
         return Response({
             "message": "Products chunk inserted successfully", 
             "count": count,
-            "method": "chunk_insert"
+            "method": "chunk_insert",
+            "chunking": recommend(AccProduct)
         })
     except Exception as e:
         logger.exception("Error inserting products chunk")
         return Response({"error": str(e)}, status=500)
 
 
+@on_write_executor
 @api_view(['POST'])
 def sync_productbatches_chunk(request):
     """
@@ -189,19 +285,24 @@ def sync_productbatches_chunk(request):
         data_count = len(request.data) if hasattr(request.data, '__len__') else 0
         logger.info(f"Inserting chunk of {data_count} product batches")
         
-        count = bulk_insert_only(AccProductBatch, request.data)
+        with SyncRunRecorder(AccProductBatch, "chunk_insert", request) as run:
+            count = bulk_insert_only(AccProductBatch, request.data, run=run)
+            run.rows = count
+        schedule_post_sync(run)
         
         logger.info(f"Successfully inserted {count} product batches")
         return Response({
             "message": "Product batches chunk inserted successfully", 
             "count": count,
-            "method": "chunk_insert"
+            "method": "chunk_insert",
+            "chunking": recommend(AccProductBatch)
         })
     except Exception as e:
         logger.exception("Error inserting product batches chunk")
         return Response({"error": str(e)}, status=500)
 
 
+@on_write_executor
 @api_view(['POST'])
 def sync_masters_chunk(request):
     """
@@ -211,19 +312,24 @@ def sync_masters_chunk(request):
         data_count = len(request.data) if hasattr(request.data, '__len__') else 0
         logger.info(f"Inserting chunk of {data_count} masters")
         
-        count = bulk_insert_only(AccMaster, request.data)
+        with SyncRunRecorder(AccMaster, "chunk_insert", request) as run:
+            count = bulk_insert_only(AccMaster, request.data, run=run, after_write=add_customers)
+            run.rows = count
+        schedule_post_sync(run)
         
         logger.info(f"Successfully inserted {count} masters")
         return Response({
             "message": "Masters chunk inserted successfully", 
             "count": count,
-            "method": "chunk_insert"
+            "method": "chunk_insert",
+            "chunking": recommend(AccMaster)
         })
     except Exception as e:
         logger.exception("Error inserting masters chunk")
         return Response({"error": str(e)}, status=500)
 
 
+@on_write_executor
 @api_view(['POST'])
 def sync_users_chunk(request):
     """
@@ -233,13 +339,17 @@ def sync_users_chunk(request):
         data_count = len(request.data) if hasattr(request.data, '__len__') else 0
         logger.info(f"Inserting chunk of {data_count} users")
         
-        count = bulk_insert_only(AccUsers, request.data)
+        with SyncRunRecorder(AccUsers, "chunk_insert", request) as run:
+            count = bulk_insert_only(AccUsers, request.data, run=run)
+            run.rows = count
+        schedule_post_sync(run)
         
         logger.info(f"Successfully inserted {count} users")
         return Response({
             "message": "Users chunk inserted successfully", 
             "count": count,
-            "method": "chunk_insert"
+            "method": "chunk_insert",
+            "chunking": recommend(AccUsers)
         })
     except Exception as e:
         logger.exception("Error inserting users chunk")
@@ -247,6 +357,7 @@ def sync_users_chunk(request):
 
 
 # Keep your existing v2 endpoints for backward compatibility
+@on_write_executor
 @api_view(['POST'])
 def sync_products_v2(request):
     """
@@ -256,76 +367,223 @@ def sync_products_v2(request):
         data_count = len(request.data) if hasattr(request.data, '__len__') else 0
         logger.info(f"Starting sync for {data_count} products")
         
-        count = bulk_insert_with_clear(AccProduct, AccProductSerializer, request.data)
+        with SyncRunRecorder(AccProduct, "clear_and_insert", request) as run:
+            count = bulk_insert_with_clear(AccProduct, AccProductSerializer, request.data, run=run)
+            run.rows = count
+            refresh_catalog_snapshot(run)
+        schedule_post_sync(run)
         
         logger.info(f"Successfully synced {count} products")
         return Response({
             "message": "Products synced successfully", 
             "count": count,
-            "method": "clear_and_insert"
+            "method": "clear_and_insert",
+            "chunking": recommend(AccProduct)
         })
     except Exception as e:
         logger.exception("Error syncing products v2")
         return Response({"error": str(e)}, status=500)
 
 
+@on_write_executor
 @api_view(['POST'])
 def sync_productbatches_v2(request):
     try:
         data_count = len(request.data) if hasattr(request.data, '__len__') else 0
         logger.info(f"Starting sync for {data_count} product batches")
         
-        count = bulk_insert_with_clear(AccProductBatch, AccProductBatchSerializer, request.data)
+        with SyncRunRecorder(AccProductBatch, "clear_and_insert", request) as run:
+            count = bulk_insert_with_clear(AccProductBatch, AccProductBatchSerializer, request.data, run=run)
+            run.rows = count
+            refresh_catalog_snapshot(run)
+        schedule_post_sync(run)
         
         logger.info(f"Successfully synced {count} product batches")
         return Response({
             "message": "Product batches synced successfully", 
             "count": count,
-            "method": "clear_and_insert"
+            "method": "clear_and_insert",
+            "chunking": recommend(AccProductBatch)
         })
     except Exception as e:
         logger.exception("Error syncing product batches v2")
         return Response({"error": str(e)}, status=500)
 
 
+@on_write_executor
 @api_view(['POST'])
 def sync_masters_v2(request):
     try:
         data_count = len(request.data) if hasattr(request.data, '__len__') else 0
         logger.info(f"Starting sync for {data_count} master records")
         
-        count = bulk_insert_with_clear(
-            AccMaster, 
-            AccMasterSerializer, 
-            request.data,
-            filter_kwargs={"super_code": "DEBTO"}
-        )
+        with SyncRunRecorder(AccMaster, "clear_and_insert", request) as run:
+            count = bulk_insert_with_clear(
+                AccMaster, 
+                AccMasterSerializer, 
+                request.data,
+                filter_kwargs={"super_code": "DEBTO"},
+                run=run,
+                after_write=rebuild_customers
+            )
+            run.rows = count
+        schedule_post_sync(run)
         
         logger.info(f"Successfully synced {count} master records")
         return Response({
             "message": "Master records synced successfully", 
             "count": count,
-            "method": "clear_and_insert"
+            "method": "clear_and_insert",
+            "chunking": recommend(AccMaster)
         })
     except Exception as e:
         logger.exception("Error syncing master records v2")
         return Response({"error": str(e)}, status=500)
 
 
+@on_write_executor
 @api_view(['POST'])
 def sync_users_v2(request):
     try:
         data_count = len(request.data) if hasattr(request.data, '__len__') else 0
         logger.info(f"Starting sync for {data_count} users")
         
-        count = bulk_insert_with_clear(AccUsers, AccUsersSerializer, request.data)
+        with SyncRunRecorder(AccUsers, "clear_and_insert", request) as run:
+            count = bulk_insert_with_clear(AccUsers, AccUsersSerializer, request.data, run=run)
+            run.rows = count
+        schedule_post_sync(run)
         
         logger.info(f"Successfully synced {count} users")
         return Response({
             "message": "Users synced successfully", 
             "count": count,
-            "method": "clear_and_insert"
+            "method": "clear_and_insert",
+            "chunking": recommend(AccUsers)
         })
     except Exception as e:
         logger.exception("Error syncing users v2")
-        return Response({"error": str(e)}, status=500)
\ No newline at end of file
+        return Response({"error": str(e)}, status=500)
+
+
+@api_view(['GET'])
+def sync_history(request):
+    """
+    Throughput trends per table, flagging runs well below the rolling baseline
+    """
+    limit = parse_limit(request.query_params.get('limit'), 50)
+    if limit is None:
+        return Response({"error": "limit must be a positive integer"}, status=400)
+    try:
+        table = request.query_params.get('table')
+        return Response({"tables": summarize_throughput(table=table, limit=limit)})
+    except Exception as e:
+        logger.exception("Error summarizing sync history")
+        return Response({"error": str(e)}, status=500)
+
+
+@on_write_executor
+@api_view(['POST'])
+def sync_catalog_snapshot(request):
+    """
+    Rebuild the catalog snapshot, e.g. after the last products/batches chunk
+    """
+    try:
+        generation, count = write_snapshot()
+        return Response({
+            "message": "Catalog snapshot rebuilt successfully",
+            "generation": generation,
+            "count": count
+        })
+    except Exception as e:
+        logger.exception("Error rebuilding catalog snapshot")
+        return Response({"error": str(e)}, status=500)
+
+
+async def _catalog_lookup_from_db(**product_filter):
+    """Fallback used until the first snapshot has been written"""
+    batch = await AccProductBatch.objects.filter(**product_filter).values('productcode', *BATCH_FIELDS).afirst()
+    code = batch['productcode'] if batch else product_filter.get('productcode')
+    if code is None:
+        return None
+    record = await AccProduct.objects.filter(code=code).values(*PRODUCT_FIELDS).afirst()
+    if record is None and batch is None:
+        return None
+    record = record or dict.fromkeys(PRODUCT_FIELDS, None) | {"code": code}
+    record.update({field: (str(batch[field]) if batch and batch[field] is not None else None) for field in BATCH_FIELDS})
+    return record
+
+
+@require_GET
+@jwt_required
+async def catalog_by_code(request, code):
+    """Look up a product and its prices by product code"""
+    watch_catalog_snapshot()
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        record = snapshot.lookup_code(code)
+    else:
+        record = await _catalog_lookup_from_db(productcode=code)
+    if record is None:
+        return JsonResponse({"error": "Product not found"}, status=404)
+    return JsonResponse({"product": record, "generation": snapshot.generation if snapshot else None})
+
+
+@require_GET
+@jwt_required
+async def catalog_by_barcode(request, barcode):
+    """Look up a product and its prices by barcode"""
+    watch_catalog_snapshot()
+    snapshot = get_snapshot()
+    if snapshot is not None:
+        record = snapshot.lookup_barcode(barcode)
+    else:
+        record = await _catalog_lookup_from_db(barcode=barcode)
+    if record is None:
+        return JsonResponse({"error": "Product not found"}, status=404)
+    return JsonResponse({"product": record, "generation": snapshot.generation if snapshot else None})
+
+
+@require_GET
+@jwt_required
+async def customer_lookup(request):
+    """
+    Find DEBTO customers by phone (either column, any formatting) and/or
+    name prefix
+    """
+    phone = request.GET.get('phone')
+    name = request.GET.get('name')
+    if not phone and not name:
+        return JsonResponse({"error": "phone or name is required"}, status=400)
+    limit = parse_limit(request.GET.get('limit'), 20)
+    if limit is None:
+        return JsonResponse({"error": "limit must be a positive integer"}, status=400)
+    limit = min(limit, 100)
+    
+    try:
+        customers = await afind_customers(phone=phone, name=name, limit=limit)
+        return JsonResponse({
+            "count": len(customers),
+            "customers": AccMasterSerializer(customers, many=True).data
+        })
+    except Exception as e:
+        logger.exception("Error looking up customers")
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+@api_view(['GET'])
+def sync_chunking(request):
+    """
+    Recommended client chunk (rows and bytes) and server batch size per table
+    """
+    return Response({
+        "tables": {
+            model._meta.db_table: recommend(model)
+            for model in (AccProduct, AccProductBatch, AccMaster, AccUsers)
+        }
+    })
+
+
+@api_view(['GET'])
+def admission_stats(request):
+    """Admission control queue depth and rejection counters for this worker"""
+    return Response({**gate.stats(), **heavy_slots.stats()})
\ No newline at end of file
@@ -1,3 +1,68 @@
+from django.db import connection
 from django.test import TestCase
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from .models import AccUsers
+
+
+class LoginTests(TestCase):
+    url = '/app1/login/'
+
+    @classmethod
+    def setUpClass(cls):
+        # acc_users is unmanaged; create it before the class transaction starts
+        with connection.schema_editor() as editor:
+            editor.create_model(AccUsers)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.schema_editor() as editor:
+            editor.delete_model(AccUsers)
+
+    @classmethod
+    def setUpTestData(cls):
+        # Fixed-width columns in the ERP database come back space padded
+        AccUsers.objects.create(id='cashier', pass_field='1234  ', role='sales')
+
+    def assertLoggedIn(self, response):
+        self.assertEqual(response.status_code, 200, response.content)
+        body = response.json()
+        self.assertEqual(body['user'], {'id': 'cashier', 'role': 'sales'})
+        token = AccessToken(body['access_token'])
+        self.assertEqual(token['user_id'], 'cashier')
+        self.assertEqual(token['role'], 'sales')
+
+    async def test_json_body(self):
+        response = await self.async_client.post(
+            self.url, {'username': 'cashier', 'password': '1234'}, content_type='application/json'
+        )
+        self.assertLoggedIn(response)
+
+    async def test_form_body(self):
+        response = await self.async_client.post(self.url, {'username': ' cashier ', 'password': '1234'})
+        self.assertLoggedIn(response)
+
+    async def test_wrong_password(self):
+        response = await self.async_client.post(
+            self.url, {'username': 'cashier', 'password': '4321'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {'error': 'Invalid credentials'})
+
+    async def test_unknown_user(self):
+        response = await self.async_client.post(self.url, {'username': 'nobody', 'password': '1234'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {'error': 'Invalid credentials'})
+
+    async def test_missing_password(self):
+        response = await self.async_client.post(
+            self.url, {'username': 'cashier'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', response.json()['details'])
+
+    async def test_get_not_allowed(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 405)
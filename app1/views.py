@@ -4,7 +4,11 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework_simplejwt.tokens import AccessToken
 from django.contrib.auth.hashers import check_password
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from datetime import timedelta
+import json
 from .models import AccUsers
 from .serializers import LoginSerializer
 
@@ -27,14 +31,18 @@ def home(request):
 
 
 # LOGIN VIEW
-@api_view(['POST'])
-@permission_classes([AllowAny])
-def login(request):
-    """Login endpoint for AccUsers (access token only)"""
-    serializer = LoginSerializer(data=request.data)
+@csrf_exempt
+@require_POST
+async def login(request):
+    """Login endpoint for AccUsers (access token only), served natively async"""
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        data = request.POST
+    serializer = LoginSerializer(data=data)
     
     if not serializer.is_valid():
-        return Response({
+        return JsonResponse({
             'error': 'Invalid input',
             'details': serializer.errors
         }, status=status.HTTP_400_BAD_REQUEST)
@@ -43,7 +51,7 @@ def login(request):
     password = serializer.validated_data['password'].strip()
     
     try:
-        user = AccUsers.objects.get(id=username)
+        user = await AccUsers.objects.aget(id=username)
         db_password = user.pass_field.strip() if user.pass_field else ""
         
         if db_password == password:
@@ -53,7 +61,7 @@ def login(request):
             access_token['user_id'] = user.id
             access_token['role'] = user.role
 
-            return Response({
+            return JsonResponse({
                 'message': 'Login successful',
                 'access_token': str(access_token),
                 'user': {
@@ -63,10 +71,10 @@ def login(request):
                 'expires_in': '365 days'
             }, status=status.HTTP_200_OK)
         else:
-            return Response({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
+            return JsonResponse({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
     
     except AccUsers.DoesNotExist:
-        return Response({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
+        return JsonResponse({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
     
     except Exception as e:
-        return Response({'error': 'Login failed', 'details': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+        return JsonResponse({'error': 'Login failed', 'details': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
@@ -0,0 +1,135 @@
+"""
+Concurrent-connection load test for the lookup and login endpoints.
+
+Opens N simultaneous keep-alive connections (like idle POS devices polling)
+and has each one issue lookups for a fixed duration, then reports how many
+connections were served, throughput and latency percentiles. Run it against
+the same code served both ways and compare:
+
+    # WSGI (current deployment)
+    gunicorn omega.wsgi -w 4 -b 127.0.0.1:8000
+    # ASGI
+    gunicorn omega.asgi -w 4 -k uvicorn.workers.UvicornWorker -b 127.0.0.1:8001
+
+    python loadtest/concurrent_lookups.py --port 8000 --connections 2000 --think 30 --ramp 30 --duration 90 --token <jwt>
+    python loadtest/concurrent_lookups.py --port 8001 --connections 2000 --think 30 --ramp 30 --duration 90 --token <jwt>
+
+Only the standard library is used so it runs anywhere the API does.
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+
+
+async def _request(reader, writer, host, method, path, token, body=None):
+    headers = [f"{method} {path} HTTP/1.1", f"Host: {host}", "Connection: keep-alive"]
+    if token:
+        headers.append(f"Authorization: Bearer {token}")
+    payload = b''
+    if body is not None:
+        payload = json.dumps(body).encode()
+        headers += ["Content-Type: application/json", f"Content-Length: {len(payload)}"]
+    writer.write(("\r\n".join(headers) + "\r\n\r\n").encode() + payload)
+    await writer.drain()
+
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split()[1])
+    length = 0
+    chunked = False
+    keep_alive = True
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode().partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+        elif name.lower() == 'transfer-encoding' and 'chunked' in value.lower():
+            chunked = True
+        elif name.lower() == 'connection' and 'close' in value.lower():
+            keep_alive = False
+    if chunked:
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(length)
+    return status, keep_alive
+
+
+async def _connect(args):
+    return await asyncio.wait_for(asyncio.open_connection(args.host, args.port), args.timeout)
+
+
+async def _client(args, deadline, latencies, stats):
+    # Devices come online spread over the ramp instead of all in the same instant
+    await asyncio.sleep(random.uniform(0, args.ramp))
+    try:
+        reader, writer = await _connect(args)
+    except Exception:
+        stats['connect_failed'] += 1
+        return
+    stats['connected'] += 1
+    try:
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            if writer.is_closing() or reader.at_eof():
+                # The server closed the connection (no keep-alive, or idle timeout)
+                writer.close()
+                reader, writer = await _connect(args)
+            if args.login:
+                status, keep_alive = await asyncio.wait_for(_request(
+                    reader, writer, args.host, 'POST', '/app1/login/', None,
+                    {'username': args.login[0], 'password': args.login[1]}), args.timeout)
+            else:
+                status, keep_alive = await asyncio.wait_for(_request(
+                    reader, writer, args.host, 'GET', args.path, args.token), args.timeout)
+            latencies.append((time.perf_counter() - start) * 1000)
+            stats[f'status_{status}'] = stats.get(f'status_{status}', 0) + 1
+            if not keep_alive:
+                writer.close()
+            await asyncio.sleep(args.think)
+    except Exception:
+        stats['errors'] += 1
+    finally:
+        writer.close()
+
+
+async def main(args):
+    latencies = []
+    stats = {'connected': 0, 'connect_failed': 0, 'errors': 0}
+    deadline = time.monotonic() + args.duration
+    await asyncio.gather(*(_client(args, deadline, latencies, stats) for _ in range(args.connections)))
+
+    print(f"target            {args.host}:{args.port}{'/app1/login/' if args.login else args.path}")
+    print(f"connections       {args.connections} requested, {stats['connected']} connected, "
+          f"{stats['connect_failed']} failed to connect, {stats['errors']} dropped/timed out")
+    print(f"requests          {len(latencies)} ({len(latencies) / args.duration:.1f}/s)")
+    for key in sorted(k for k in stats if k.startswith('status_')):
+        print(f"  {key:16}{stats[key]}")
+    if latencies:
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(f"latency ms        p50 {quantiles[49]:.1f}  p95 {quantiles[94]:.1f}  "
+              f"p99 {quantiles[98]:.1f}  max {max(latencies):.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--path', default='/api/catalog/code/P1', help="lookup path to poll")
+    parser.add_argument('--token', help="JWT access token for the lookup endpoints")
+    parser.add_argument('--login', nargs=2, metavar=('USERNAME', 'PASSWORD'), help="exercise login instead")
+    parser.add_argument('--connections', type=int, default=500)
+    parser.add_argument('--duration', type=float, default=20.0, help="seconds")
+    parser.add_argument('--think', type=float, default=1.0, help="idle seconds between requests per connection")
+    parser.add_argument('--ramp', type=float, default=0.0, help="seconds over which connections are opened")
+    parser.add_argument('--timeout', type=float, default=10.0)
+    asyncio.run(main(parser.parse_args()))
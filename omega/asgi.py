@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'omega.settings')
+# Tells the sync write views to use their own thread pool (see ASGI_SERVER)
+os.environ.setdefault('ASGI_SERVER', 'True')
 
 application = get_asgi_application()
@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -82,8 +82,95 @@ SIMPLE_JWT = {
     'TOKEN_TYPE_CLAIM': 'token_type',
 }
 
+# Sync run history: a run is flagged as a regression when its rows/sec falls
+# below SYNC_REGRESSION_RATIO times the median of the previous runs. Runs with
+# fewer than SYNC_BASELINE_MIN_ROWS_RATIO times their typical row count (the
+# last chunk of an upload) are not judged.
+SYNC_BASELINE_WINDOW = config('SYNC_BASELINE_WINDOW', default=20, cast=int)
+SYNC_BASELINE_MIN_SAMPLES = config('SYNC_BASELINE_MIN_SAMPLES', default=5, cast=int)
+SYNC_BASELINE_MIN_ROWS_RATIO = config('SYNC_BASELINE_MIN_ROWS_RATIO', default=0.25, cast=float)
+SYNC_REGRESSION_RATIO = config('SYNC_REGRESSION_RATIO', default=0.5, cast=float)
+# Sync runs older than this are deleted, checked at most once an hour per worker
+SYNC_RUN_RETENTION_DAYS = config('SYNC_RUN_RETENTION_DAYS', default=90, cast=int)
+SYNC_RUN_PRUNE_INTERVAL = config('SYNC_RUN_PRUNE_INTERVAL', default=3600, cast=int)
+
+# Shared mmapped catalog snapshot; must be on a path every worker can read
+CATALOG_SNAPSHOT_PATH = config('CATALOG_SNAPSHOT_PATH', default=str(BASE_DIR / 'catalog.snapshot'))
+
+# Post-sync maintenance, run on a background thread once a table has had no
+# sync activity on any worker for POST_SYNC_DELAY seconds; one worker runs
+# the database steps per table (PostgreSQL advisory lock), while
+# catalog_snapshot runs on every host. Tables not listed in
+# POST_SYNC_PIPELINE get vacuum, analyze, refresh_views and prewarm.
+POST_SYNC_ENABLED = config('POST_SYNC_ENABLED', default=True, cast=bool)
+POST_SYNC_ASYNC = config('POST_SYNC_ASYNC', default=True, cast=bool)
+POST_SYNC_DELAY = config('POST_SYNC_DELAY', default=5.0, cast=float)
+# How often a worker serving catalog lookups checks its host's snapshot
+POST_SYNC_SNAPSHOT_INTERVAL = config('POST_SYNC_SNAPSHOT_INTERVAL', default=30.0, cast=float)
+POST_SYNC_VACUUM_MIN_DEAD = config('POST_SYNC_VACUUM_MIN_DEAD', default=1000, cast=int)
+POST_SYNC_VACUUM_DEAD_RATIO = config('POST_SYNC_VACUUM_DEAD_RATIO', default=0.2, cast=float)
+POST_SYNC_PIPELINE = {
+    'acc_product': ['vacuum', 'analyze', 'refresh_views', 'catalog_snapshot', 'prewarm'],
+    'acc_productbatch': ['vacuum', 'analyze', 'refresh_views', 'catalog_snapshot', 'prewarm'],
+    'acc_master': ['vacuum', 'analyze', 'refresh_views', 'prewarm'],
+    'acc_users': ['vacuum', 'analyze'],
+}
+# Materialized views to refresh after a table is synced, e.g.
+# {'acc_product': ['product_price_view']}
+POST_SYNC_MATERIALIZED_VIEWS = {}
+
+# Set once acc_master has been converted with `manage.py partition_acc_master`;
+# scoped syncs then swap in a staging table for the super_code partition and
+# scoped clears truncate it, instead of DELETE
+ACC_MASTER_PARTITIONED = config('ACC_MASTER_PARTITIONED', default=False, cast=bool)
+
+# Set by omega/asgi.py. Only then are the sync/clear endpoints moved onto a
+# pool of SYNC_WRITE_WORKERS threads; under WSGI they run on the server's own
+# request threads. Lookups and login run as native async views either way.
+ASGI_SERVER = config('ASGI_SERVER', default=False, cast=bool)
+SYNC_WRITE_WORKERS = config('SYNC_WRITE_WORKERS', default=4, cast=int)
+
+# Client chunk recommendation: stay under this many request bytes (keep it
+# below DATA_UPLOAD_MAX_MEMORY_SIZE and the proxy body limit) and this many
+# seconds per request
+SYNC_CHUNK_TARGET_BYTES = config('SYNC_CHUNK_TARGET_BYTES', default=2000000, cast=int)
+SYNC_CHUNK_TARGET_SECONDS = config('SYNC_CHUNK_TARGET_SECONDS', default=2.0, cast=float)
+
+# Admission control (api.admission): token buckets as (tokens per second,
+# burst) per user, client address and claimed X-Client-Id, and a cap on
+# concurrent sync/clear writes with a bounded wait queue. Limits apply per
+# worker process, except that on PostgreSQL ADMISSION_MAX_HEAVY also caps
+# sync/clear writes across all processes.
+ADMISSION_CONTROL_ENABLED = config('ADMISSION_CONTROL_ENABLED', default=True, cast=bool)
+ADMISSION_PATHS = ('/api/', '/app1/login/')
+# Requests one worker process serves at once: its thread count (e.g.
+# gunicorn --threads) under WSGI
+ADMISSION_CONCURRENCY = config('ADMISSION_CONCURRENCY', default=64 if ASGI_SERVER else 8, cast=int)
+ADMISSION_MAX_HEAVY = config('ADMISSION_MAX_HEAVY', default=SYNC_WRITE_WORKERS, cast=int)
+# Take the ADMISSION_MAX_HEAVY slots as PostgreSQL advisory locks shared by
+# every worker process and host
+ADMISSION_SHARED_HEAVY = config('ADMISSION_SHARED_HEAVY', default=True, cast=bool)
+# Under WSGI the queue is further capped to the threads left over after the
+# heavy slots and the light share below, since every waiter holds a thread
+ADMISSION_HEAVY_QUEUE = config('ADMISSION_HEAVY_QUEUE', default=16, cast=int)
+ADMISSION_HEAVY_TIMEOUT = config('ADMISSION_HEAVY_TIMEOUT', default=30.0, cast=float)
+# Fraction of ADMISSION_CONCURRENCY busy with light requests at which heavy
+# requests get half the slots. Lower under WSGI so the default 8 threads
+# leave 8 - 4 heavy - 2 light = 2 for queued heavy requests
+ADMISSION_LIGHT_BUSY = config('ADMISSION_LIGHT_BUSY', default=0.5 if ASGI_SERVER else 0.25, cast=float)
+ADMISSION_RATES = {
+    'heavy': (10, 50),
+    'light': (20, 100),
+}
+# Proxies whose X-Forwarded-For is believed when finding the client address
+ADMISSION_TRUSTED_PROXIES = config('ADMISSION_TRUSTED_PROXIES', default='127.0.0.1', cast=Csv())
+# An address may carry this many clients' worth of traffic (a branch's
+# devices behind one NAT)
+ADMISSION_ADDRESS_SHARE = config('ADMISSION_ADDRESS_SHARE', default=4, cast=int)
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'api.admission.AdmissionControlMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',